@@ -0,0 +1,368 @@
+# Copyright (c) 2026, Djaodjin Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+In-process caches used to keep per-request work off the database.
+"""
+
+from collections import OrderedDict
+import hashlib, logging, threading, time
+
+from django.core.cache import caches
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+class LRUCache(object):
+    """
+    A bounded, thread-safe, least-recently-used mapping.
+
+    When *maxsize* is ``0``, nothing is ever stored. When *maxsize* is
+    ``None``, the mapping is unbounded.
+    """
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        """
+        Stores *value* under *key* and returns the list of ``(key, value)``
+        pairs that were evicted to make room for it.
+        """
+        evicted = []
+        if self.maxsize == 0:
+            return evicted
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while (self.maxsize is not None and
+                   len(self._data) > self.maxsize):
+                evicted.append(self._data.popitem(last=False))
+                self.evictions += 1
+        return evicted
+
+    def pop(self, key, default=None):
+        with self._lock:
+            return self._data.pop(key, default)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def items(self):
+        with self._lock:
+            return list(self._data.items())
+
+    def stats(self):
+        return {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions
+        }
+
+
+class TTLCache(LRUCache):
+    """
+    A bounded least-recently-used mapping whose entries expire
+    *timeout* seconds after they were stored (never when *timeout*
+    is ``None``).
+    """
+
+    def __init__(self, maxsize=128, timeout=60):
+        super(TTLCache, self).__init__(maxsize=maxsize)
+        self.timeout = timeout
+
+    def __contains__(self, key):
+        return self.get(key, self) is not self
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                expires_at, value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        expires_at = (time.monotonic() + self.timeout
+            if self.timeout is not None else float('inf'))
+        return [(evicted_key, evicted_value)
+            for evicted_key, (_, evicted_value) in super(TTLCache, self).set(
+                key, (expires_at, value))]
+
+    def items(self):
+        now = time.monotonic()
+        return [(key, value)
+            for key, (expires_at, value) in super(TTLCache, self).items()
+            if expires_at > now]
+
+
+class SecretsCache(TTLCache):
+    """
+    Decrypted values of encrypted ``Site`` fields, keyed by
+    ``(site pk, field name, ...)``.
+    """
+
+    def __init__(self, maxsize=128, timeout=60):
+        super(SecretsCache, self).__init__(maxsize=maxsize, timeout=timeout)
+        self.decryptions = 0
+
+    def get_or_load(self, key, load):
+        """
+        Returns the value cached under *key*, calling *load()* to decrypt
+        it on a miss. Exceptions raised by *load* are not cached.
+        """
+        sentinel = self._data # any object that cannot be a cached value
+        value = self.get(key, sentinel)
+        if value is sentinel:
+            self.decryptions += 1
+            value = load()
+            self.set(key, value)
+        return value
+
+    def discard_site(self, site_pk):
+        with self._lock:
+            for key in [key for key in self._data if key[0] == site_pk]:
+                del self._data[key]
+
+    def stats(self):
+        stats = super(SecretsCache, self).stats()
+        stats.update({'decryptions': self.decryptions})
+        return stats
+
+
+class _Flight(object):
+    """
+    A resolution in progress that concurrent callers wait on.
+    """
+    __slots__ = ('event', 'result', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SiteCache(TTLCache):
+    """
+    Caches the outcome of resolving a request host into a ``Site``.
+
+    Entries expire after *timeout* seconds, which bounds how long a process
+    keeps serving a ``Site`` saved by another process.
+
+    Concurrent misses on the same key are collapsed into a single call
+    to the resolver (single-flight). Results computed while the cache
+    was being invalidated are returned to the callers but not stored.
+    """
+
+    def __init__(self, maxsize=128, timeout=60):
+        super(SiteCache, self).__init__(maxsize=maxsize, timeout=timeout)
+        self.generation = 0
+        self._flights = {}
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._data.clear()
+
+    def get_or_resolve(self, key, resolve):
+        """
+        Returns the value cached under *key*, calling *resolve()* to compute
+        it on a miss. Exceptions raised by *resolve* are propagated to all
+        callers waiting on *key* and are not cached.
+        """
+        if self.maxsize == 0:
+            return resolve()
+        sentinel = self._flights # any object that cannot be a cached value
+        with self._lock:
+            value = self.get(key, sentinel)
+            if value is not sentinel:
+                return value
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self._flights[key] = flight
+                generation = self.generation
+
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = resolve()
+        except Exception as err: #pylint:disable=broad-except
+            flight.error = err
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+                if flight.error is None and generation == self.generation:
+                    self.set(key, flight.result)
+            flight.event.set()
+        return flight.result
+
+
+class SharedSiteCache(object):
+    """
+    Second-level cache of host-to-``Site`` resolutions shared by all
+    processes configured with the same Django cache backend *alias*.
+
+    Entries are stored under a version equal to a global generation
+    counter. Bumping the counter, which is done every time a ``Site``
+    is saved, makes all previously stored entries unreachable. Each process
+    re-reads the counter at most once every *poll_interval* seconds.
+    """
+    generation_key = 'multitier:sites:generation'
+    key_prefix = 'multitier:site:'
+
+    def __init__(self, alias, poll_interval=5):
+        self.alias = alias
+        self.poll_interval = poll_interval
+        self.generation = None
+        self._polled_at = None
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def make_key(self, key):
+        # Hosts are user input. We hash them so keys are always valid
+        # for backends like memcached.
+        return self.key_prefix + hashlib.sha1(
+            repr(key).encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _new_generation():
+        # A time-based value makes sure we do not re-use the version
+        # of stale entries when the counter itself was evicted.
+        return int(time.time() * 1000)
+
+    def get_generation(self):
+        generation = self.cache.get(self.generation_key)
+        if generation is None:
+            self.cache.add(self.generation_key, self._new_generation(),
+                timeout=None)
+            generation = self.cache.get(self.generation_key)
+        return generation
+
+    def poll_due(self):
+        return (self._polled_at is None or
+            time.monotonic() - self._polled_at >= self.poll_interval)
+
+    def poll(self):
+        """
+        Re-reads the generation counter when *poll_interval* has elapsed
+        since the last time it was read, and returns ``True`` if it changed.
+        """
+        now = time.monotonic()
+        if (self._polled_at is not None and
+            now - self._polled_at < self.poll_interval):
+            return False
+        self._polled_at = now
+        try:
+            generation = self.get_generation()
+        except Exception as err: #pylint:disable=broad-except
+            LOGGER.warning("multitier: cannot read site cache generation: %s",
+                err)
+            return False
+        changed = (self.generation is not None and
+            generation != self.generation)
+        self.generation = generation
+        return changed
+
+    def bump(self):
+        """
+        Invalidates the entries stored by all processes.
+        """
+        try:
+            try:
+                self.generation = self.cache.incr(self.generation_key)
+            except ValueError:
+                # The counter does not exist (yet or anymore).
+                self.generation = self._new_generation()
+                self.cache.set(self.generation_key, self.generation,
+                    timeout=None)
+        except Exception as err: #pylint:disable=broad-except
+            LOGGER.warning(
+                "multitier: cannot bump site cache generation: %s", err)
+        self._polled_at = time.monotonic()
+
+    def get_or_resolve(self, key, resolve):
+        """
+        Returns the value stored under *key* for the current generation,
+        calling *resolve()* and storing its result on a miss.
+        """
+        if self.generation is None:
+            self.poll()
+        shared_key = self.make_key(key)
+        value = None
+        try:
+            value = self.cache.get(shared_key, version=self.generation)
+        except Exception as err: #pylint:disable=broad-except
+            LOGGER.warning("multitier: cannot read site cache: %s", err)
+        if value is None:
+            value = resolve()
+            try:
+                self.cache.set(shared_key, value, version=self.generation)
+            except Exception as err: #pylint:disable=broad-except
+                LOGGER.warning("multitier: cannot write site cache: %s", err)
+        return value
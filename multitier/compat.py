@@ -51,6 +51,11 @@ except ModuleNotFoundError: #pylint:disable=undefined-variable
     from django.core.urlresolvers import (NoReverseMatch, RegexURLPattern,
         RegexURLResolver, reverse, reverse_lazy)
 
+try:
+    from django.urls import get_script_prefix, get_urlconf
+except ImportError: # <= Django 1.10
+    from django.core.urlresolvers import get_script_prefix, get_urlconf
+
 try:
     from django.urls import include, re_path
 except ImportError: # <= Django 2.0, Python<3.6
@@ -114,6 +119,17 @@ def get_app_model_class(app_label, model_name, settings_meta=None):
     return model_class
 
 
+try:
+    from asgiref.sync import sync_to_async
+except ImportError: # django < 3.0
+    sync_to_async = None
+
+try:
+    from asgiref.sync import iscoroutinefunction
+except ImportError: # asgiref < 3.6
+    from asyncio import iscoroutinefunction
+
+
 try:
     from django.utils.deprecation import MiddlewareMixin
 except ImportError: # django < 1.11
@@ -0,0 +1,166 @@
+# Copyright (c) 2026, Djaodjin Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Runs a function against many sites concurrently.
+
+Example::
+
+    from multitier.fanout import for_each_site
+
+    for res in for_each_site(
+            lambda site: User.objects.filter(is_active=True).count(),
+            max_workers=8, timeout=30):
+        if res.error:
+            LOGGER.error("%s: %s", res.site, res.error)
+        else:
+            total += res.result
+"""
+
+from collections import namedtuple
+import logging, queue, threading, time
+
+from django.db import connections
+from django.db.models.query import QuerySet
+
+from .thread_locals import site_context
+from .utils import get_site_model
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+SiteResult = namedtuple('SiteResult', ['site', 'result', 'error', 'elapsed'])
+SiteResult.__doc__ = """
+Outcome of running a function for *site*. *error* is the exception
+raised, if any, and *elapsed* the time it took in seconds.
+"""
+
+
+class SiteTimeout(Exception):
+    """
+    The function did not complete within the allotted time for a site.
+    """
+
+
+class _Job(object):
+    __slots__ = ('site', 'started_at')
+
+    def __init__(self, site):
+        self.site = site
+        self.started_at = None
+
+
+def run_for_site(func, site, job=None):
+    """
+    Calls *func(site)* with *site* as the current site and returns
+    a ``SiteResult``. When *func* returns a ``QuerySet``, it is evaluated
+    into a list while *site* is current.
+    """
+    start = time.monotonic()
+    if job is not None:
+        job.started_at = start
+    result = None
+    error = None
+    try:
+        with site_context(site):
+            result = func(site)
+            if isinstance(result, QuerySet):
+                result = list(result)
+    except Exception as err: #pylint:disable=broad-except
+        LOGGER.debug("multitier: error running %s for site '%s': %s",
+            func, site, err)
+        error = err
+    finally:
+        # Connections opened by a worker thread are never re-used
+        # for another site.
+        connections.close_all()
+    return SiteResult(site, result, error, time.monotonic() - start)
+
+
+def for_each_site(func, sites=None, max_workers=4, timeout=None):
+    """
+    Calls *func(site)* for each site in *sites* (defaults to all active
+    sites) on at most *max_workers* threads, and yields a ``SiteResult``
+    for each site as soon as it completes.
+
+    When *timeout* is set and *func* has been running for longer than
+    *timeout* seconds for a site, a ``SiteResult`` with a ``SiteTimeout``
+    error is yielded for that site. Python threads cannot be interrupted,
+    so the call keeps its (daemon) thread until it returns by itself.
+    That thread no longer counts towards *max_workers* and its result
+    is discarded, such that hung sites do not prevent other sites
+    from running.
+    """
+    if sites is None:
+        sites = get_site_model().objects.filter(is_active=True)
+    sites = iter(sites)
+    results = queue.Queue()
+    running = {}
+    exhausted = False
+
+    def run(job):
+        results.put((job, run_for_site(func, job.site, job)))
+
+    while True:
+        # We only start as many jobs as there are workers, such that
+        # sites are read lazily and timeouts apply to running jobs.
+        while not exhausted and len(running) < max_workers:
+            try:
+                site = next(sites)
+            except StopIteration:
+                exhausted = True
+                break
+            job = _Job(site)
+            job.started_at = time.monotonic()
+            running[job] = threading.Thread(target=run, args=(job,),
+                name='multitier-fanout-%s' % site, daemon=True)
+            running[job].start()
+        if not running:
+            break
+
+        wait_timeout = None
+        if timeout is not None:
+            wait_timeout = max(min([job.started_at for job in running])
+                + timeout - time.monotonic(), 0)
+        try:
+            job, res = results.get(timeout=wait_timeout)
+        except queue.Empty:
+            pass
+        else:
+            # The result of a job that timed out was already yielded.
+            if running.pop(job, None) is not None:
+                yield res
+
+        if timeout is not None:
+            now = time.monotonic()
+            for job in list(running):
+                if now - job.started_at >= timeout:
+                    del running[job]
+                    LOGGER.warning(
+                        "multitier: site '%s' timed out after %ss",
+                        job.site, timeout)
+                    yield SiteResult(job.site, None,
+                        SiteTimeout("'%s' timed out after %ss" % (
+                        job.site, timeout)), now - job.started_at)
@@ -0,0 +1,127 @@
+# Copyright (c) 2026, Djaodjin Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Records the migration state of site-specific databases, such that
+databases already at the latest migrations can be skipped on deploy
+without opening a connection to them.
+
+The index is a JSON file (``MULTITIER['MIGRATION_INDEX']``) mapping
+a database key to the fingerprint of the migration graph it was last
+fully migrated to.
+"""
+
+import hashlib, json, logging, os, tempfile, threading
+
+from . import settings
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+def get_migration_fingerprint():
+    """
+    Returns a hash of the leaf nodes of the migration graph defined
+    by the code. It only reads migration files, not the database.
+    """
+    #pylint:disable=import-outside-toplevel
+    from django.db.migrations.loader import MigrationLoader
+    loader = MigrationLoader(None, ignore_no_migrations=True)
+    leaf_nodes = sorted(loader.graph.leaf_nodes())
+    return hashlib.sha1(json.dumps(leaf_nodes).encode('utf-8')).hexdigest()
+
+
+def get_database_key(site):
+    """
+    Returns the key identifying the database of *site* in the index.
+    """
+    return '%s@%s:%s' % (site.db_name or '', site.db_host or '',
+        site.db_port or '')
+
+
+class MigrationIndex(object):
+    """
+    Fingerprints of the migration state of databases, stored in the JSON
+    file at *path*.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._fingerprints = None
+
+    @property
+    def fingerprints(self):
+        if self._fingerprints is None:
+            self._fingerprints = self.load()
+        return self._fingerprints
+
+    def load(self):
+        try:
+            with open(self.path) as index_file:
+                return json.load(index_file)
+        except (IOError, OSError):
+            return {}
+        except ValueError as err:
+            LOGGER.warning("multitier: ignoring corrupted migration index"\
+                " '%s': %s", self.path, err)
+            return {}
+
+    def save(self):
+        """
+        Writes the index to a temporary file, then moves it to *path*
+        such that readers never see a partial file.
+        """
+        with self._lock:
+            content = json.dumps(self.fingerprints, indent=2, sort_keys=True)
+            dir_path = os.path.dirname(os.path.abspath(self.path))
+            fd, tmp_path = tempfile.mkstemp(dir=dir_path, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'w') as index_file:
+                    index_file.write(content)
+                os.replace(tmp_path, self.path)
+            except Exception:
+                os.remove(tmp_path)
+                raise
+
+    def is_current(self, site, fingerprint):
+        return self.fingerprints.get(get_database_key(site)) == fingerprint
+
+    def record(self, site, fingerprint):
+        with self._lock:
+            self.fingerprints[get_database_key(site)] = fingerprint
+
+    def discard(self, site):
+        with self._lock:
+            self.fingerprints.pop(get_database_key(site), None)
+
+
+def get_migration_index():
+    """
+    Returns the ``MigrationIndex`` at ``MULTITIER['MIGRATION_INDEX']``,
+    or ``None`` when the setting is not defined.
+    """
+    if not settings.MIGRATION_INDEX:
+        return None
+    return MigrationIndex(settings.MIGRATION_INDEX)
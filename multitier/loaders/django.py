@@ -21,15 +21,32 @@
 # WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
 # OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
 # ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+Template loaders for the Django template engine that look up templates
+in the themes of the current site.
+
+``CachedLoader`` is used in place of Django's ``cached.Loader``::
+
+    'loaders': [
+        ('multitier.loaders.django.CachedLoader', [
+            'multitier.loaders.django.Loader',
+            'django.template.loaders.filesystem.Loader',
+            'django.template.loaders.app_directories.Loader'])]
+"""
 from __future__ import absolute_import
 
-import logging
+import logging, os
 
 import django
-from django.conf import settings
+from django.conf import settings as django_settings
+from django.template import TemplateDoesNotExist
+from django.template.loaders.cached import Loader as BaseCachedLoader
 from django.template.loaders.filesystem import Loader as FilesystemLoader
 from django.utils._os import safe_join
 
+from multitier import settings
+from multitier.caches import LRUCache
+from multitier.loaders.index import get_template_index
 from multitier.thread_locals import get_current_site
 from multitier.compat import Origin
 
@@ -37,25 +54,52 @@ from multitier.compat import Origin
 LOGGER = logging.getLogger(__name__)
 
 
+def get_themes_key():
+    """
+    Returns the themes (``Site.get_templates()``) of the current site
+    as a tuple, or ``None`` when there is no current site.
+    """
+    current_site = get_current_site()
+    if current_site:
+        return tuple(current_site.get_templates())
+    return None
+
+
+def _get_mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except (OSError, TypeError, ValueError):
+        return None
+
+
 class Loader(FilesystemLoader):
 
     def __init__(self, engine):
         super(Loader, self).__init__(engine)
         self.encoding = 'utf-8'
+        # Search paths only depend on the themes of the site
+        # (see ``Site.get_template_dirs``).
+        self._searchpaths = LRUCache(maxsize=settings.TEMPLATE_CACHE_SIZE)
 
     def searchpath(self, template_dirs=None):
         if not template_dirs:
             try:
                 template_dirs = self.get_dirs() #pylint:disable=no-member
             except AttributeError: # django < 1.8
-                template_dirs = settings.TEMPLATE_DIRS
+                template_dirs = django_settings.TEMPLATE_DIRS
         current_site = get_current_site()
         if current_site:
-            loader_template_dirs = []
-            for template_dir in current_site.get_template_dirs():
-                loader_template_dirs.append(safe_join(template_dir, 'django'))
-                loader_template_dirs.append(template_dir)
-            template_dirs = loader_template_dirs + list(template_dirs)
+            key = (tuple(current_site.get_templates()), tuple(template_dirs))
+            searchpath = self._searchpaths.get(key)
+            if searchpath is None:
+                loader_template_dirs = []
+                for template_dir in current_site.get_template_dirs():
+                    loader_template_dirs.append(
+                        safe_join(template_dir, 'django'))
+                    loader_template_dirs.append(template_dir)
+                searchpath = tuple(loader_template_dirs + list(template_dirs))
+                self._searchpaths.set(key, searchpath)
+            template_dirs = list(searchpath)
         return template_dirs
 
     def get_template_sources(self, template_name, template_dirs=None):
@@ -63,6 +107,9 @@ class Loader(FilesystemLoader):
             for template_dir in self.searchpath(template_dirs=template_dirs):
                 try:
                     template_path = safe_join(template_dir, template_name)
+                    if (settings.TEMPLATE_INDEX and
+                        not get_template_index().isfile(template_path)):
+                        continue
                     if django.VERSION[0] <= 1 and django.VERSION[1] < 9:
                         yield template_path
                     else:
@@ -85,3 +132,54 @@ class Loader(FilesystemLoader):
             # The middleware might be misconfigured.
             LOGGER.warning(
                 "%s, your middleware might be misconfigured.", attr_err)
+
+
+class CachedLoader(BaseCachedLoader):
+    """
+    Caches compiled templates per themes of the current site, such that
+    sites using the same themes share compiled templates.
+
+    At most ``MULTITIER['TEMPLATE_CACHE_SIZE']`` templates are kept.
+    When ``MULTITIER['TEMPLATE_CACHE_CHECK_MTIME']`` is ``True`` (defaults
+    to ``DEBUG``), a template is compiled again when its file was modified,
+    and templates that were not found are looked up again on every call.
+    """
+
+    def __init__(self, engine, loaders):
+        super(CachedLoader, self).__init__(engine, loaders)
+        self.get_template_cache = LRUCache(
+            maxsize=settings.TEMPLATE_CACHE_SIZE)
+        self.check_mtime = settings.TEMPLATE_CACHE_CHECK_MTIME
+
+    def cache_key(self, template_name, skip=None):
+        return (get_themes_key(),
+            super(CachedLoader, self).cache_key(template_name, skip=skip))
+
+    @staticmethod
+    def is_uptodate(template):
+        # Negative entries are never kept when we check mtimes.
+        return (not isinstance(template, type) and
+            not isinstance(template, TemplateDoesNotExist) and
+            getattr(template, 'multitier_mtime', None) == _get_mtime(
+                template.origin.name))
+
+    def get_template(self, template_name, skip=None):
+        if not self.check_mtime:
+            return super(CachedLoader, self).get_template(
+                template_name, skip=skip)
+        key = self.cache_key(template_name, skip=skip)
+        cached = self.get_template_cache.get(key)
+        if cached is not None and not self.is_uptodate(cached):
+            self.get_template_cache.pop(key)
+        try:
+            template = super(CachedLoader, self).get_template(
+                template_name, skip=skip)
+        except TemplateDoesNotExist:
+            self.get_template_cache.pop(key)
+            raise
+        if not hasattr(template, 'multitier_mtime'):
+            template.multitier_mtime = _get_mtime(template.origin.name)
+        return template
+
+    def stats(self):
+        return self.get_template_cache.stats()
@@ -0,0 +1,165 @@
+# Copyright (c) 2026, Djaodjin Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+In-memory index of the files in template directories, enabled with
+``MULTITIER['TEMPLATE_INDEX'] = True``.
+
+The template loaders look for a template in each theme directory
+of the current site, then in the base directories, in turn. Instead
+of a ``stat`` or ``open`` per directory tried, the index answers
+from the list of files of each directory, read on first use. A directory
+is listed again when its mtime changed, which is checked at most every
+``MULTITIER['TEMPLATE_INDEX_REFRESH_INTERVAL']`` seconds.
+"""
+
+import logging, os, time
+
+from .. import settings
+from ..caches import LRUCache
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+class _Listing(object):
+    """
+    Names of the files in a directory (``None`` when the directory
+    does not exist) and the directory mtime when they were read.
+    """
+    __slots__ = ('files', 'mtime', 'checked_at')
+
+    def __init__(self, files, mtime, checked_at):
+        self.files = files
+        self.mtime = mtime
+        self.checked_at = checked_at
+
+
+class TemplateIndex(object):
+    """
+    Listings of up to *maxsize* directories, each checked for changes
+    at most every *refresh_interval* seconds.
+
+    The outcome of looking up a path, found or not, is also recorded,
+    for up to *max_paths* paths, until its directory is checked again.
+    """
+
+    def __init__(self, maxsize=1024, refresh_interval=5, max_paths=16384):
+        self.refresh_interval = refresh_interval
+        self.max_paths = max_paths
+        self.listings = LRUCache(maxsize=maxsize)
+        self.reads = 0
+        self._paths = {}
+
+    @staticmethod
+    def get_mtime(path):
+        try:
+            return os.stat(path).st_mtime_ns
+        except (OSError, ValueError):
+            return None
+
+    def read(self, path):
+        """
+        Returns a ``_Listing`` of the directory at *path*.
+        """
+        self.reads += 1
+        mtime = self.get_mtime(path)
+        files = None
+        if mtime is not None:
+            try:
+                files = frozenset([entry.name for entry in os.scandir(path)
+                    if entry.is_file()])
+            except (OSError, ValueError):
+                mtime = None
+        checked_at = time.monotonic()
+        if mtime is not None and time.time_ns() - mtime < 1000000000:
+            # Files added within the same mtime tick would go unnoticed.
+            # We do not trust a listing of a directory modified
+            # that recently.
+            checked_at = None
+        return _Listing(files, mtime, checked_at)
+
+    def get_listing(self, path):
+        listing = self.listings.get(path)
+        if listing is None:
+            listing = self.read(path)
+            self.listings.set(path, listing)
+        elif (listing.checked_at is None or
+              time.monotonic() - listing.checked_at >= self.refresh_interval):
+            if (listing.checked_at is not None and
+                self.get_mtime(path) == listing.mtime):
+                listing.checked_at = time.monotonic()
+            else:
+                LOGGER.debug("multitier: reading %s again", path)
+                listing = self.read(path)
+                self.listings.set(path, listing)
+        return listing
+
+    def isfile(self, path):
+        """
+        Returns ``True`` if *path* is a file according to the index.
+        """
+        # Called for every directory tried by the loaders. We avoid
+        # locks here: entries are only ever replaced, never modified.
+        entry = self._paths.get(path)
+        if entry is not None:
+            checked_at = entry[0].checked_at
+            if (checked_at is not None and
+                time.monotonic() - checked_at < self.refresh_interval):
+                return entry[1]
+        dirname, basename = os.path.split(path)
+        listing = self.get_listing(dirname)
+        found = listing.files is not None and basename in listing.files
+        if len(self._paths) >= self.max_paths:
+            self._paths = {}
+        self._paths[path] = (listing, found)
+        return found
+
+    def clear(self):
+        self.listings.clear()
+        self._paths = {}
+
+    def stats(self):
+        stats = self.listings.stats()
+        stats.update({'reads': self.reads, 'paths': len(self._paths)})
+        return stats
+
+
+_template_index = TemplateIndex( #pylint:disable=invalid-name
+    maxsize=settings.TEMPLATE_CACHE_SIZE,
+    refresh_interval=settings.TEMPLATE_INDEX_REFRESH_INTERVAL)
+
+
+def get_template_index():
+    return _template_index
+
+
+def template_isfile(path):
+    """
+    Same as ``os.path.isfile`` but answered from the template index
+    when ``MULTITIER['TEMPLATE_INDEX']`` is ``True``.
+    """
+    if settings.TEMPLATE_INDEX:
+        return _template_index.isfile(path)
+    return os.path.isfile(path)
@@ -28,6 +28,7 @@ import hashlib, logging, os
 from django.utils._os import safe_join
 import jinja2
 
+from multitier.loaders.index import template_isfile
 from multitier.thread_locals import get_current_site
 
 
@@ -62,12 +63,17 @@ class Loader(jinja2.FileSystemLoader):
         digest = None
         for searchpath in self.get_template_dirs():
             filename = os.path.join(searchpath, *pieces)
-            if os.path.isfile(filename):
+            if template_isfile(filename):
+                try:
+                    with open(filename, "rb") as template_file:
+                        data = template_file.read()
+                except OSError:
+                    # The template index is stale (ex: file was deleted).
+                    LOGGER.debug("cannot read template %s", filename)
+                    continue
                 LOGGER.debug("found template %s", filename)
-                with open(filename, "rb") as template_file:
-                    data = template_file.read()
-                    digest = hashlib.sha1(data).hexdigest()
-                    contents = data.decode(self.encoding)
+                digest = hashlib.sha1(data).hexdigest()
+                contents = data.decode(self.encoding)
                 break
 #            else:
 #                LOGGER.debug("tried template %s", filename)
@@ -0,0 +1,317 @@
+# Copyright (c) 2026, Djaodjin Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+E-mail backend that re-uses SMTP connections across messages, requests
+and threads, enabled with ``MULTITIER['EMAIL_POOL'] = True``.
+
+Connections are pooled per ``(host, port, username, ...)``, such that
+sites sharing the same SMTP credentials share connections, and sites
+with their own SMTP server do not pay for a TCP/TLS handshake and
+an SMTP AUTH on every e-mail.
+"""
+
+import logging, smtplib, threading, time
+
+from django.core.mail.backends.smtp import EmailBackend
+
+from . import settings
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+def _is_alive(connection):
+    try:
+        return connection.noop()[0] == 250
+    except (smtplib.SMTPException, OSError):
+        return False
+
+
+def _close(connection):
+    try:
+        connection.quit()
+    except (smtplib.SMTPException, OSError):
+        try:
+            connection.close()
+        except (smtplib.SMTPException, OSError):
+            pass
+
+
+class SMTPConnectionPool(object):
+    """
+    At most *maxsize* open SMTP connections per key, in use or idle.
+
+    Idle connections are checked with a NOOP every *keepalive_interval*
+    seconds by a background thread, and closed after *idle_timeout*
+    seconds. When all connections for a key are in use, ``acquire``
+    waits up to *wait_timeout* seconds for one to be released.
+    """
+
+    def __init__(self, maxsize=4, idle_timeout=60, keepalive_interval=15,
+                 wait_timeout=30):
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self.keepalive_interval = keepalive_interval
+        self.wait_timeout = wait_timeout
+        self.opened = 0
+        self.reused = 0
+        self.closed = 0
+        self.waits = 0
+        self._idle = {}
+        self._in_use = {}
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def _decrement_in_use(self, key):
+        # Must be called with `_cond` held. Keys contain credentials,
+        # so we do not keep them around longer than necessary.
+        count = self._in_use.get(key, 0) - 1
+        if count > 0:
+            self._in_use[key] = count
+        else:
+            self._in_use.pop(key, None)
+
+    def acquire(self, key):
+        """
+        Reserves a connection for *key* and returns an idle connection,
+        or ``None`` when the caller must open a new connection.
+        """
+        deadline = time.monotonic() + self.wait_timeout
+        with self._cond:
+            while True:
+                idle = self._idle.get(key)
+                if idle:
+                    last_used, last_checked, connection = idle.pop()
+                    if not idle:
+                        del self._idle[key]
+                    self._in_use[key] = self._in_use.get(key, 0) + 1
+                    break
+                if self._in_use.get(key, 0) < self.maxsize:
+                    self._in_use[key] = self._in_use.get(key, 0) + 1
+                    self.opened += 1
+                    return None
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise smtplib.SMTPException(
+                        "no SMTP connection available for %s:%s" % key[:2])
+                self.waits += 1
+                self._cond.wait(remaining)
+        now = time.monotonic()
+        if (now - last_used >= self.idle_timeout or
+            (now - last_checked >= self.keepalive_interval and
+             not _is_alive(connection))):
+            _close(connection)
+            with self._cond:
+                self.closed += 1
+                self.opened += 1
+            return None
+        with self._cond:
+            self.reused += 1
+        return connection
+
+    def release(self, key, connection, last_used=None):
+        """
+        Returns *connection* to the idle connections for *key*.
+        """
+        now = time.monotonic()
+        with self._cond:
+            self._decrement_in_use(key)
+            self._idle.setdefault(key, []).append(
+                (last_used or now, now, connection))
+            self._cond.notify()
+        self.start()
+
+    def discard(self, key, connection=None):
+        """
+        Frees the slot reserved for *key*, closing *connection* if any.
+        """
+        with self._cond:
+            self._decrement_in_use(key)
+            if connection is not None:
+                self.closed += 1
+            self._cond.notify()
+        if connection is not None:
+            _close(connection)
+
+    def keepalive(self):
+        """
+        Closes connections idle for more than *idle_timeout* and sends
+        a NOOP on connections idle for more than *keepalive_interval*.
+        """
+        now = time.monotonic()
+        expired = []
+        checked = []
+        with self._cond:
+            for key, idle in list(self._idle.items()):
+                kept = []
+                for last_used, last_checked, connection in idle:
+                    if now - last_used >= self.idle_timeout:
+                        expired += [connection]
+                    elif now - last_checked >= self.keepalive_interval:
+                        checked += [(key, last_used, connection)]
+                        self._in_use[key] = self._in_use.get(key, 0) + 1
+                    else:
+                        kept += [(last_used, last_checked, connection)]
+                if kept:
+                    self._idle[key] = kept
+                else:
+                    del self._idle[key]
+            self.closed += len(expired)
+        for connection in expired:
+            _close(connection)
+        for key, last_used, connection in checked:
+            if _is_alive(connection):
+                # The NOOP reset the idle timer of the server.
+                self.release(key, connection, last_used=last_used)
+            else:
+                self.discard(key, connection)
+
+    def start(self):
+        if self._thread is not None or not self.keepalive_interval:
+            return
+        with self._cond:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run,
+                name='multitier-smtp-pool')
+            self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.keepalive_interval)
+            try:
+                self.keepalive()
+            except Exception as err: #pylint:disable=broad-except
+                LOGGER.exception(
+                    "multitier: cannot keep SMTP connections alive: %s", err)
+
+    def clear(self):
+        """
+        Closes all idle connections.
+        """
+        with self._cond:
+            connections = [connection for idle in self._idle.values()
+                for _, _, connection in idle]
+            self._idle.clear()
+            self.closed += len(connections)
+        for connection in connections:
+            _close(connection)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'idle': sum([len(idle) for idle in self._idle.values()]),
+                'in_use': sum(self._in_use.values()),
+                'opened': self.opened,
+                'reused': self.reused,
+                'closed': self.closed,
+                'waits': self.waits
+            }
+
+
+_smtp_pool = SMTPConnectionPool( #pylint:disable=invalid-name
+    maxsize=settings.EMAIL_POOL_SIZE,
+    idle_timeout=settings.EMAIL_POOL_IDLE_TIMEOUT,
+    keepalive_interval=settings.EMAIL_POOL_KEEPALIVE_INTERVAL,
+    wait_timeout=settings.EMAIL_POOL_WAIT_TIMEOUT)
+
+
+def get_email_pool_stats():
+    """
+    Returns the number of idle and in use SMTP connections, and how many
+    were opened, re-used and closed.
+    """
+    return _smtp_pool.stats()
+
+
+class PooledEmailBackend(EmailBackend):
+    """
+    SMTP backend that takes its connection from a process-wide pool
+    and returns it there when closed.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(PooledEmailBackend, self).__init__(*args, **kwargs)
+        self.broken = False
+
+    @property
+    def pool_key(self):
+        return (self.host, self.port, self.username, self.password,
+            self.use_tls, self.use_ssl, self.ssl_keyfile, self.ssl_certfile)
+
+    def open(self):
+        if self.connection:
+            return False
+        self.broken = False
+        key = self.pool_key
+        try:
+            connection = _smtp_pool.acquire(key)
+        except smtplib.SMTPException:
+            if not self.fail_silently:
+                raise
+            return None
+        if connection is not None:
+            self.connection = connection
+            return True
+        try:
+            opened = super(PooledEmailBackend, self).open()
+        except Exception:
+            _smtp_pool.discard(key)
+            raise
+        if not opened:
+            _smtp_pool.discard(key)
+        return opened
+
+    def close(self):
+        connection = self.connection
+        if connection is None:
+            return
+        self.connection = None
+        if self.broken:
+            _smtp_pool.discard(self.pool_key, connection)
+        else:
+            _smtp_pool.release(self.pool_key, connection)
+
+    def send_messages(self, email_messages):
+        try:
+            return super(PooledEmailBackend, self).send_messages(
+                email_messages)
+        except Exception:
+            # Django does not close the connection when sending fails,
+            # which would keep its slot in the pool reserved.
+            self.close()
+            raise
+
+    def _send(self, email_message):
+        try:
+            sent = super(PooledEmailBackend, self)._send(email_message)
+        except Exception:
+            self.broken = True
+            raise
+        if not sent and email_message.recipients():
+            # ``fail_silently`` swallowed an error.
+            self.broken = True
+        return sent
@@ -0,0 +1,483 @@
+# Copyright (c) 2026, Djaodjin Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+E-mail backend that spools messages to a local SQLite database
+(``MULTITIER['EMAIL_QUEUE_PATH']``) and a worker that sends them later,
+such that the latency of a site SMTP server does not add to the latency
+of requests.
+
+Use it with::
+
+    EMAIL_BACKEND = 'multitier.mailqueue.QueuedEmailBackend'
+
+The worker runs in a daemon thread of every process that queues
+messages (``EMAIL_QUEUE_WORKER``), or as ``manage.py send_queued_emails``.
+Messages are sent in batches grouped by site, through one connection
+per site and batch, built with ``EMAIL_QUEUE_BACKEND``. The per-site
+``EMAIL_QUEUE_RATE_LIMIT`` applies to all workers sharing the spool.
+"""
+
+import logging, pickle, sqlite3, threading, time
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.mail import get_connection
+from django.core.mail.backends.base import BaseEmailBackend
+
+from . import settings
+from .thread_locals import get_current_site
+from .utils import get_site_model
+
+
+LOGGER = logging.getLogger(__name__)
+
+STATUS_QUEUED = 0
+STATUS_FAILED = 1
+
+
+class EmailSpool(object):
+    """
+    Messages waiting to be sent, stored in the SQLite database at *path*.
+
+    Rows are claimed by a worker for *lease* seconds, such that
+    concurrent workers, in this process or others, do not send
+    the same message twice.
+    """
+
+    def __init__(self, path, lease=300):
+        self.path = path
+        self.lease = lease
+        self._initialized = False
+        self._lock = threading.Lock()
+
+    def connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        if not self._initialized:
+            with self._lock:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("CREATE TABLE IF NOT EXISTS messages ("
+                    "id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                    " site_id INTEGER,"
+                    " message BLOB NOT NULL,"
+                    " status INTEGER NOT NULL DEFAULT 0,"
+                    " attempts INTEGER NOT NULL DEFAULT 0,"
+                    " next_attempt_at REAL NOT NULL,"
+                    " created_at REAL NOT NULL,"
+                    " last_error TEXT)")
+                conn.execute("CREATE INDEX IF NOT EXISTS messages_due"\
+                    " ON messages (status, next_attempt_at)")
+                conn.execute("CREATE TABLE IF NOT EXISTS rate_buckets ("
+                    "site_id INTEGER,"
+                    " tokens REAL NOT NULL,"
+                    " updated_at REAL NOT NULL)")
+                self._initialized = True
+        return conn
+
+    def enqueue(self, site_id, email_messages):
+        now = time.time()
+        rows = []
+        for message in email_messages:
+            connection = message.connection
+            message.connection = None
+            try:
+                rows += [(site_id, pickle.dumps(message), now, now)]
+            finally:
+                message.connection = connection
+        conn = self.connect()
+        try:
+            conn.executemany("INSERT INTO messages"\
+                " (site_id, message, next_attempt_at, created_at)"\
+                " VALUES (?, ?, ?, ?)", rows)
+        finally:
+            conn.close()
+        return len(rows)
+
+    def claim(self, limit, rate_limiter=None):
+        """
+        Returns up to *limit* messages due to be sent as a list
+        of ``(id, site_id, attempts, message)``, ordered by site,
+        and the number of due messages looked at.
+
+        When *rate_limiter* is specified, messages for sites over their
+        rate are left as they are, to be claimed once the rate allows.
+        """
+        now = time.time()
+        conn = self.connect()
+        try:
+            # The rate limits are shared by all workers using the spool,
+            # so they are checked and updated in the same transaction
+            # as the messages are claimed.
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                where = "status = ? AND next_attempt_at <= ?"
+                params = [STATUS_QUEUED, now]
+                if rate_limiter is not None:
+                    blocked = rate_limiter.blocked(conn, now)
+                    if None in blocked:
+                        where += " AND site_id IS NOT NULL"
+                        blocked.discard(None)
+                    if blocked:
+                        where += " AND (site_id IS NULL"\
+                            " OR site_id NOT IN (%s))" % (
+                            ", ".join(["?"] * len(blocked)))
+                        params += sorted(blocked)
+                rows = conn.execute("SELECT id, site_id, attempts, message"\
+                    " FROM messages WHERE %s ORDER BY id LIMIT ?" % where,
+                    params + [limit]).fetchall()
+                nb_due = len(rows)
+                if rate_limiter is not None:
+                    rows = rate_limiter.filter(conn, now, rows,
+                        key=lambda row: row[1])
+                conn.executemany(
+                    "UPDATE messages SET next_attempt_at = ? WHERE id = ?",
+                    [(now + self.lease, row[0]) for row in rows])
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        finally:
+            conn.close()
+        results = []
+        for message_id, site_id, attempts, blob in rows:
+            try:
+                message = pickle.loads(blob)
+            except Exception as err: #pylint:disable=broad-except
+                LOGGER.error("multitier: cannot load queued e-mail %d: %s",
+                    message_id, err)
+                self.fail([message_id], str(err))
+                continue
+            results += [(message_id, site_id, attempts, message)]
+        results.sort(key=lambda row: (row[1] is not None, row[1] or 0, row[0]))
+        return results, nb_due
+
+    def delete(self, message_ids):
+        self._execute_many("DELETE FROM messages WHERE id = ?",
+            [(message_id,) for message_id in message_ids])
+
+    def reschedule(self, message_ids, delay, attempts=None, error=None):
+        """
+        Makes messages due again in *delay* seconds.
+        """
+        next_attempt_at = time.time() + delay
+        if attempts is None:
+            self._execute_many(
+                "UPDATE messages SET next_attempt_at = ? WHERE id = ?",
+                [(next_attempt_at, message_id) for message_id in message_ids])
+        else:
+            self._execute_many("UPDATE messages SET next_attempt_at = ?,"\
+                " attempts = ?, last_error = ? WHERE id = ?",
+                [(next_attempt_at, attempts, error, message_id)
+                 for message_id in message_ids])
+
+    def fail(self, message_ids, error):
+        self._execute_many("UPDATE messages SET status = ?, last_error = ?"\
+            " WHERE id = ?", [(STATUS_FAILED, error, message_id)
+                for message_id in message_ids])
+
+    def stats(self):
+        conn = self.connect()
+        try:
+            counts = dict(conn.execute("SELECT status, COUNT(*)"\
+                " FROM messages GROUP BY status").fetchall())
+        finally:
+            conn.close()
+        return {'queued': counts.get(STATUS_QUEUED, 0),
+            'failed': counts.get(STATUS_FAILED, 0)}
+
+    def _execute_many(self, sql, rows):
+        if not rows:
+            return
+        conn = self.connect()
+        try:
+            conn.executemany(sql, rows)
+        finally:
+            conn.close()
+
+
+class RateLimiter(object):
+    """
+    Token bucket allowing *rate* messages per minute for each site.
+
+    Buckets are stored in the spool database, such that the rate applies
+    to all workers sending messages from the same spool.
+    """
+
+    def __init__(self, rate=None):
+        self.rate = rate
+
+    def get_tokens(self, conn, now):
+        """
+        Returns the number of tokens available at *now* for each site
+        that recently sent messages. Other sites have *rate* tokens.
+        """
+        # A bucket is full again after a minute.
+        conn.execute("DELETE FROM rate_buckets WHERE updated_at <= ?",
+            (now - 60,))
+        return {site_id: min(self.rate,
+                tokens + (now - updated_at) * self.rate / 60.0)
+            for site_id, tokens, updated_at in conn.execute(
+                "SELECT site_id, tokens, updated_at FROM rate_buckets")}
+
+    def blocked(self, conn, now):
+        """
+        Returns the set of sites for which no message can be sent now.
+        """
+        if not self.rate:
+            return set([])
+        return set([site_id
+            for site_id, tokens in self.get_tokens(conn, now).items()
+            if tokens < 1])
+
+    def filter(self, conn, now, rows, key):
+        """
+        Returns the *rows* that can be sent now, where ``key(row)``
+        is the site of a row, and takes their tokens.
+        """
+        if not self.rate:
+            return rows
+        counts = {}
+        for row in rows:
+            site_id = key(row)
+            counts[site_id] = counts.get(site_id, 0) + 1
+        tokens = self.get_tokens(conn, now)
+        allowed = {}
+        for site_id, count in counts.items():
+            available = tokens.get(site_id, self.rate)
+            allowed[site_id] = min(count, int(available))
+            conn.execute("DELETE FROM rate_buckets WHERE site_id IS ?",
+                (site_id,))
+            conn.execute("INSERT INTO rate_buckets"\
+                " (site_id, tokens, updated_at) VALUES (?, ?, ?)",
+                (site_id, available - allowed[site_id], now))
+        results = []
+        for row in rows:
+            site_id = key(row)
+            if allowed[site_id] > 0:
+                allowed[site_id] -= 1
+                results += [row]
+        return results
+
+
+class EmailQueueWorker(object):
+    """
+    Sends the messages in *spool*.
+    """
+
+    def __init__(self, spool, batch_size=100, interval=5, max_attempts=5,
+                 retry_delay=60, rate_limit=None, backend=None):
+        self.spool = spool
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.rate_limiter = RateLimiter(rate_limit)
+        self.backend = backend
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def get_connection(self, site_id, sites):
+        if site_id is None:
+            return get_connection(self.backend)
+        site = sites.get(site_id)
+        if site is None:
+            site = get_site_model().objects.filter(pk=site_id).first()
+            sites[site_id] = site
+        if site is None:
+            # The site was deleted since.
+            return get_connection(self.backend)
+        return site.get_email_connection(backend=self.backend)
+
+    def send_batch(self):
+        """
+        Sends one batch of due messages and returns the number
+        of due messages looked at.
+        """
+        rows, nb_due = self.spool.claim(self.batch_size,
+            rate_limiter=self.rate_limiter)
+        by_sites = []
+        for row in rows:
+            if by_sites and by_sites[-1][0] == row[1]:
+                by_sites[-1][1].append(row)
+            else:
+                by_sites += [(row[1], [row])]
+        sites = {}
+        for site_id, site_rows in by_sites:
+            self.send_site_messages(site_id, site_rows, sites)
+        return nb_due
+
+    def send_site_messages(self, site_id, rows, sites):
+        sent_ids = []
+        connection = None
+        try:
+            for idx, (message_id, _, attempts, message) in enumerate(rows):
+                if not message.recipients():
+                    # Backends do not send those, so they would only
+                    # be retried until they fail.
+                    LOGGER.warning("multitier: dropping e-mail %d"\
+                        " without recipients", message_id)
+                    sent_ids += [message_id]
+                    continue
+                if connection is None:
+                    try:
+                        connection = self.get_connection(site_id, sites)
+                        connection.open()
+                    except Exception as err: #pylint:disable=broad-except
+                        # The SMTP server of the site cannot be reached.
+                        # We do not try again for each message.
+                        for row in rows[idx:]:
+                            self.retry(row[0], row[2], err)
+                        connection = None
+                        break
+                try:
+                    if not connection.send_messages([message]):
+                        raise RuntimeError("message was not sent")
+                    sent_ids += [message_id]
+                except Exception as err: #pylint:disable=broad-except
+                    self.retry(message_id, attempts, err)
+                    # The connection might be in an undefined state.
+                    try:
+                        connection.close()
+                    except Exception: #pylint:disable=broad-except
+                        pass
+                    connection = None
+        finally:
+            if connection is not None:
+                try:
+                    connection.close()
+                except Exception: #pylint:disable=broad-except
+                    pass
+            self.spool.delete(sent_ids)
+            self.sent += len(sent_ids)
+
+    def retry(self, message_id, attempts, err):
+        attempts += 1
+        if attempts >= self.max_attempts:
+            LOGGER.error("multitier: giving up on e-mail %d after %d"\
+                " attempts: %s", message_id, attempts, err)
+            self.spool.fail([message_id], str(err))
+            self.failed += 1
+            return
+        delay = self.retry_delay * 2 ** (attempts - 1)
+        LOGGER.warning("multitier: cannot send e-mail %d (attempt %d),"\
+            " retrying in %ds: %s", message_id, attempts, delay, err)
+        self.spool.reschedule([message_id], delay,
+            attempts=attempts, error=str(err))
+        self.retried += 1
+
+    def drain(self):
+        """
+        Sends batches until no message is due.
+        """
+        with self._lock:
+            while self.send_batch() >= self.batch_size:
+                pass
+
+    def wakeup(self):
+        self._wakeup.set()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self.run,
+                name='multitier-email-queue')
+            self._thread.daemon = True
+        self._thread.start()
+
+    def run(self):
+        #pylint:disable=import-outside-toplevel
+        from django.db import connections
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try:
+                self.drain()
+            except Exception as err: #pylint:disable=broad-except
+                LOGGER.exception(
+                    "multitier: cannot send queued e-mails: %s", err)
+            finally:
+                connections.close_all()
+
+    def stats(self):
+        stats = self.spool.stats()
+        stats.update({'sent': self.sent, 'retried': self.retried,
+            'gave_up': self.failed})
+        return stats
+
+
+_email_spool = EmailSpool( #pylint:disable=invalid-name
+    settings.EMAIL_QUEUE_PATH)
+_email_queue_worker = EmailQueueWorker( #pylint:disable=invalid-name
+    _email_spool,
+    batch_size=settings.EMAIL_QUEUE_BATCH_SIZE,
+    interval=settings.EMAIL_QUEUE_INTERVAL,
+    max_attempts=settings.EMAIL_QUEUE_MAX_ATTEMPTS,
+    retry_delay=settings.EMAIL_QUEUE_RETRY_DELAY,
+    rate_limit=settings.EMAIL_QUEUE_RATE_LIMIT,
+    backend=settings.EMAIL_QUEUE_BACKEND)
+
+
+def get_email_queue_worker():
+    return _email_queue_worker
+
+
+class QueuedEmailBackend(BaseEmailBackend):
+    """
+    Adds messages to the spool instead of sending them. Messages are
+    then sent through the connection of *site* (defaults to the current
+    site).
+    """
+
+    def __init__(self, fail_silently=False, site=None, **kwargs):
+        super(QueuedEmailBackend, self).__init__(
+            fail_silently=fail_silently, **kwargs)
+        if site is None:
+            current_site = get_current_site()
+            if current_site is not None:
+                site = current_site.snapshot
+        self.site_id = site.pk if site is not None else None
+        if settings.EMAIL_QUEUE_BACKEND == (
+                '%s.%s' % (__name__, self.__class__.__name__)):
+            raise ImproperlyConfigured("EMAIL_QUEUE_BACKEND cannot be %s" %
+                settings.EMAIL_QUEUE_BACKEND)
+
+    def send_messages(self, email_messages):
+        if not email_messages:
+            return 0
+        try:
+            queued = _email_spool.enqueue(self.site_id, email_messages)
+        except Exception: #pylint:disable=broad-except
+            if not self.fail_silently:
+                raise
+            return 0
+        if settings.EMAIL_QUEUE_WORKER:
+            _email_queue_worker.start()
+            _email_queue_worker.wakeup()
+        return queued
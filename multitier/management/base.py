@@ -0,0 +1,49 @@
+# Copyright (c) 2026, Djaodjin Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Helpers shared by management commands that run for many sites.
+"""
+
+from django.core.management.base import CommandError
+
+from ..utils import get_site_model
+
+
+def get_sites(slugs=None):
+    """
+    Returns the sites in the comma-separated list of *slugs*, or all
+    active sites when *slugs* is not specified, ordered by primary key.
+    """
+    queryset = get_site_model().objects.all()
+    if slugs:
+        slugs = [slug.strip() for slug in slugs.split(',') if slug.strip()]
+        queryset = queryset.filter(slug__in=slugs)
+        missing = set(slugs) - set(queryset.values_list('slug', flat=True))
+        if missing:
+            raise CommandError("Unknown sites: %s" % ', '.join(
+                sorted(missing)))
+    else:
+        queryset = queryset.filter(is_active=True)
+    return list(queryset.order_by('pk'))
@@ -0,0 +1,198 @@
+# Copyright (c) 2026, Djaodjin Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+This command checks the SMTP settings of each site, in parallel.
+
+For each site, it connects to the SMTP server, issues STARTTLS (when
+the site is configured to use TLS) and AUTH (when the site has
+credentials), and optionally sends a test e-mail. It then prints
+how long each step took, or the step that failed.
+
+Example::
+
+    python manage.py probe_smtp --workers 16 --timeout 10
+    python manage.py probe_smtp --sites example1 --send admin@example.com
+
+Sites with the same SMTP server and credentials are only probed once.
+"""
+
+import smtplib, time
+
+from django.core.mail import EmailMessage
+from django.core.mail.utils import DNS_NAME
+from django.core.management.base import BaseCommand, CommandError
+
+from ...fanout import SiteTimeout, for_each_site
+from ..base import get_sites
+
+
+PROBE_STEPS = ('connect', 'starttls', 'auth', 'send')
+
+
+class Command(BaseCommand):
+    help = """Checks the SMTP settings of each site, in parallel"""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sites', metavar='slugs',
+            help="comma-separated list of sites to probe"\
+            " (defaults to all active sites)")
+        parser.add_argument('--workers', type=int, default=8,
+            help="number of SMTP servers probed concurrently")
+        parser.add_argument('--timeout', type=float, default=10,
+            help="seconds after which a site is reported as failed")
+        parser.add_argument('--send', metavar='recipient', default=None,
+            help="also send a test e-mail to recipient")
+
+    @staticmethod
+    def get_backend(site):
+        return site.get_email_connection(
+            backend='django.core.mail.backends.smtp.EmailBackend')
+
+    @staticmethod
+    def get_probe_key(backend):
+        return (backend.host, backend.port, backend.username,
+            backend.password, backend.use_tls, backend.use_ssl)
+
+    @staticmethod
+    def get_ssl_kwargs(backend):
+        # ``EmailBackend.ssl_context`` was added in Django 4.0.
+        if hasattr(type(backend), 'ssl_context'):
+            return {'context': backend.ssl_context}
+        return {'keyfile': backend.ssl_keyfile,
+            'certfile': backend.ssl_certfile}
+
+    @staticmethod
+    def probe(backend, timeout=None, recipient=None, from_email=None):
+        """
+        Runs each step of sending an e-mail through *backend* and returns
+        a dictionary of the seconds each step took. When a step fails,
+        the exception raised has ``step`` and ``timings`` attributes.
+        """
+        timings = {}
+        step = 'connect'
+        connection = None
+        try:
+            start = time.monotonic()
+            kwargs = {'local_hostname': DNS_NAME.get_fqdn()}
+            if backend.timeout is not None or timeout is not None:
+                kwargs['timeout'] = (backend.timeout
+                    if backend.timeout is not None else timeout)
+            if backend.use_ssl:
+                kwargs.update(Command.get_ssl_kwargs(backend))
+            connection = backend.connection_class(**kwargs)
+            connection.connect(backend.host, backend.port)
+            connection.ehlo()
+            timings[step] = time.monotonic() - start
+
+            if not backend.use_ssl and backend.use_tls:
+                step = 'starttls'
+                start = time.monotonic()
+                connection.starttls(**Command.get_ssl_kwargs(backend))
+                timings[step] = time.monotonic() - start
+
+            if backend.username and backend.password:
+                step = 'auth'
+                start = time.monotonic()
+                connection.login(backend.username, backend.password)
+                timings[step] = time.monotonic() - start
+
+            if recipient:
+                step = 'send'
+                start = time.monotonic()
+                message = EmailMessage("SMTP probe",
+                    "This is a test e-mail.", from_email, [recipient])
+                connection.sendmail(from_email, [recipient],
+                    message.message().as_bytes(linesep='\r\n'))
+                timings[step] = time.monotonic() - start
+        except Exception as err:
+            err.step = step
+            err.timings = timings
+            raise
+        finally:
+            if connection is not None:
+                try:
+                    connection.quit()
+                except (smtplib.SMTPException, OSError):
+                    connection.close()
+        return timings
+
+    def handle(self, *args, **options):
+        #pylint:disable=too-many-locals
+        sites = get_sites(options['sites'])
+
+        # Many sites use the default SMTP server. We only probe it once.
+        backends = {}
+        probed = {}
+        for site in sites:
+            backend = self.get_backend(site)
+            backends[site.pk] = backend
+            probed.setdefault(self.get_probe_key(backend), site)
+
+        recipient = options['send']
+        timeout = options['timeout']
+
+        def run(site):
+            return self.probe(backends[site.pk], timeout=timeout,
+                recipient=recipient, from_email=site.get_from_email())
+
+        start = time.monotonic()
+        results = {}
+        for res in for_each_site(run, sites=list(probed.values()),
+                max_workers=options['workers'], timeout=timeout):
+            results[self.get_probe_key(backends[res.site.pk])] = res
+        elapsed = time.monotonic() - start
+
+        rows = []
+        failed = 0
+        for site in sites:
+            backend = backends[site.pk]
+            res = results[self.get_probe_key(backend)]
+            if res.error is None:
+                timings = res.result
+                status = "ok"
+            else:
+                failed += 1
+                timings = getattr(res.error, 'timings', {})
+                if isinstance(res.error, SiteTimeout):
+                    status = "timeout"
+                else:
+                    status = "%s failed: %s" % (
+                        getattr(res.error, 'step', 'connect'), res.error)
+            rows += [[site.slug, "%s:%s" % (backend.host, backend.port)] +
+                ["%.0f" % (timings[step] * 1000) if step in timings else "-"
+                 for step in PROBE_STEPS] +
+                ["%.0f" % (res.elapsed * 1000), status]]
+
+        headers = ['site', 'server'] + [
+            "%s (ms)" % step for step in PROBE_STEPS] + ['total (ms)', 'status']
+        widths = [max([len(headers[idx])] + [len(row[idx]) for row in rows])
+            for idx in range(len(headers) - 1)]
+        for row in [headers] + rows:
+            self.stdout.write('  '.join([col.ljust(width)
+                for col, width in zip(row[:-1], widths)] + [row[-1]]))
+        self.stdout.write("%d sites (%d SMTP servers) in %.2fs, %d failed" % (
+            len(sites), len(probed), elapsed, failed))
+        if failed:
+            raise CommandError("SMTP probe failed for %d sites" % failed)
@@ -0,0 +1,67 @@
+# Copyright (c) 2026, Djaodjin Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+This command prints per-site database query statistics aggregated
+in ``MULTITIER['QUERY_STATS_CACHE_BACKEND']`` by all processes.
+"""
+
+import logging
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ... import settings
+from ...querystats import clear_shared_query_stats, get_shared_query_stats
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = """Prints per-site database query statistics"""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clear', action='store_true', default=False,
+            help="reset the statistics after printing them")
+
+    def handle(self, *args, **options):
+        if not settings.QUERY_STATS_CACHE_BACKEND:
+            raise CommandError(
+                "MULTITIER['QUERY_STATS_CACHE_BACKEND'] is not set.")
+        results = get_shared_query_stats()
+        self.stdout.write("%-32s %10s %12s %10s" % (
+            'site', 'queries', 'total (ms)', 'avg (ms)'))
+        for slug, stats in sorted(results.items(),
+                key=lambda item: item[1]['duration'], reverse=True):
+            count = stats['count']
+            duration = stats['duration'] * 1000
+            self.stdout.write("%-32s %10d %12.1f %10.2f" % (
+                slug or '-', count, duration,
+                duration / count if count else 0))
+            if options['verbosity'] > 1:
+                for query_duration, sql in stats['slowest']:
+                    self.stdout.write("    %8.2fms %s" % (
+                        query_duration * 1000, sql))
+        if options['clear']:
+            clear_shared_query_stats()
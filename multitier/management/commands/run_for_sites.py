@@ -0,0 +1,196 @@
+# Copyright (c) 2026, Djaodjin Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+This command runs another management command for each site, in parallel.
+
+Example::
+
+    python manage.py run_for_sites --workers 8 migrate --noinput
+    python manage.py run_for_sites --sites example1,example2 check
+
+With ``--skip-current``, ``migrate`` is not run for databases that
+``MULTITIER['MIGRATION_INDEX']`` records as already fully migrated
+to the migrations defined by the code.
+
+With ``MULTITIER['DB_SCHEMAS']``, ``migrate`` creates the schema of
+a site when it does not exist yet.
+"""
+
+import argparse, logging, sys, time
+from io import StringIO
+
+from django.core.management import (call_command, get_commands,
+    load_command_class)
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from ...fanout import for_each_site
+from ...fingerprints import get_migration_fingerprint, get_migration_index
+from ...routers import SiteRouter
+from ...schemas import SCHEMAS_DB_ALIAS, create_schema
+from ..base import get_sites
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = """Runs a management command for each site, in parallel"""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sites', metavar='slugs',
+            help="comma-separated list of sites to run the command for"\
+            " (defaults to all active sites)")
+        parser.add_argument('--workers', type=int, default=4,
+            help="number of sites the command runs for concurrently")
+        parser.add_argument('--timeout', type=float, default=None,
+            help="seconds after which a site is reported as failed")
+        parser.add_argument('--skip-current', action='store_true',
+            default=False,
+            help="do not run migrate for databases already recorded"\
+            " as current in the migration index")
+        parser.add_argument('subcommand', metavar='command',
+            help="management command to run")
+        parser.add_argument('subcommand_args', metavar='args',
+            nargs=argparse.REMAINDER,
+            help="arguments passed to the management command")
+
+    @staticmethod
+    def get_subcommand_parser(subcommand):
+        try:
+            app_name = get_commands()[subcommand]
+        except KeyError:
+            raise CommandError("Unknown command: %r" % subcommand)
+        if isinstance(app_name, BaseCommand):
+            command = app_name
+        else:
+            command = load_command_class(app_name, subcommand)
+        return command.create_parser('', subcommand)
+
+    @staticmethod
+    def is_full_migrate(subcommand, parser, subcommand_args):
+        """
+        Returns ``True`` if the command brings all apps to their latest
+        migrations.
+        """
+        if subcommand != 'migrate':
+            return False
+        options = parser.parse_args(subcommand_args)
+        return not (options.app_label or options.plan or
+            getattr(options, 'check_unapplied', False))
+
+    @staticmethod
+    def get_sites(slugs=None, unique_db=False):
+        sites = get_sites(slugs)
+        if unique_db:
+            # Running a database command twice, concurrently,
+            # on the same database is at best redundant.
+            by_db_name = {}
+            for site in sites:
+                by_db_name.setdefault(site.db_name, site)
+            sites = list(by_db_name.values())
+        return sites
+
+    def handle(self, *args, **options):
+        #pylint:disable=too-many-locals,too-many-statements
+        subcommand = options['subcommand']
+        subcommand_args = options['subcommand_args']
+        parser = self.get_subcommand_parser(subcommand)
+        #pylint:disable=protected-access
+        with_database = (
+            any(action.dest == 'database' for action in parser._actions) and
+            not any(arg == '--database' or arg.startswith('--database=')
+                for arg in subcommand_args))
+        sites = self.get_sites(options['sites'], unique_db=with_database)
+
+        index = None
+        fingerprint = None
+        if with_database and self.is_full_migrate(
+                subcommand, parser, subcommand_args):
+            index = get_migration_index()
+            if index is not None:
+                fingerprint = get_migration_fingerprint()
+        if options['skip_current']:
+            if index is None:
+                raise CommandError("--skip-current requires a full migrate"\
+                    " and MULTITIER['MIGRATION_INDEX'] to be set.")
+            nb_current = len(sites)
+            sites = [site for site in sites
+                if not index.is_current(site, fingerprint)]
+            nb_current -= len(sites)
+            self.stdout.write("%d sites already current" % nb_current)
+
+        def run(site):
+            kwargs = {'stdout': StringIO(), 'stderr': StringIO()}
+            if with_database:
+                kwargs.update({
+                    'database': SiteRouter.provider_db() or DEFAULT_DB_ALIAS})
+            try:
+                if (kwargs.get('database') == SCHEMAS_DB_ALIAS and
+                    subcommand == 'migrate'):
+                    create_schema(site.db_name)
+                try:
+                    call_command(subcommand, *subcommand_args, **kwargs)
+                except SystemExit as err:
+                    # Must not abort the other sites.
+                    raise CommandError("exit status %s" % err.code)
+            except Exception as err:
+                err.output = (kwargs['stdout'].getvalue() +
+                    kwargs['stderr'].getvalue())
+                raise
+            return kwargs['stdout'].getvalue()
+
+        nb_sites = len(sites)
+        failed = []
+        start = time.monotonic()
+        for idx, res in enumerate(for_each_site(run, sites=sites,
+                max_workers=options['workers'], timeout=options['timeout'])):
+            if index is not None:
+                if res.error is None:
+                    index.record(res.site, fingerprint)
+                else:
+                    index.discard(res.site)
+            if res.error is not None:
+                failed += [res.site]
+                self.stdout.write("[%d/%d] %s FAILED in %.2fs: %s" % (
+                    idx + 1, nb_sites, res.site.slug, res.elapsed, res.error))
+                output = getattr(res.error, 'output', None)
+                if output:
+                    self.stdout.write(output)
+            else:
+                self.stdout.write("[%d/%d] %s ok in %.2fs" % (
+                    idx + 1, nb_sites, res.site.slug, res.elapsed))
+                if options['verbosity'] > 1 and res.result:
+                    self.stdout.write(res.result)
+        if index is not None:
+            index.save()
+        self.stdout.write("%d sites in %.2fs, %d failed" % (
+            nb_sites, time.monotonic() - start, len(failed)))
+        if failed:
+            self.stdout.write("retry with: %s run_for_sites --sites %s %s" % (
+                sys.argv[0], ','.join([site.slug for site in failed]),
+                ' '.join([subcommand] + subcommand_args)))
+            raise CommandError("%s failed for %d sites" % (
+                subcommand, len(failed)))
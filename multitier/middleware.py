@@ -26,89 +26,312 @@
 import logging, re
 
 from django.conf import settings as django_settings
+from django.db import transaction
 from django.db.models import Q
+from django.db.models.signals import post_delete, post_save
 from django.http import Http404
 
 from . import settings
-from .utils import get_site_model
-from .thread_locals import clear_cache, set_current_site
-from .compat import MiddlewareMixin
+from .caches import SharedSiteCache, SiteCache, TTLCache
+from .querystats import end_request_stats, start_request_stats
+from .registry import SiteRegistry
+from .snapshots import as_site_snapshot
+from .utils import SITE_DEFERRED_FIELDS, get_site_model
+from .thread_locals import clear_cache, clear_site_secrets, set_current_site
+from .compat import MiddlewareMixin, iscoroutinefunction, sync_to_async
 
 
 LOGGER = logging.getLogger(__name__)
 
+#pylint:disable=invalid-name
+_site_cache = SiteCache(maxsize=settings.SITE_CACHE_SIZE,
+    timeout=settings.SITE_CACHE_TIMEOUT)
+_shared_site_cache = (SharedSiteCache(settings.SITE_CACHE_BACKEND,
+    poll_interval=settings.SITE_CACHE_POLL_INTERVAL)
+    if settings.SITE_CACHE_BACKEND else None)
+# Hosts and candidates known not to match any active ``Site``.
+_missing_site_cache = TTLCache(maxsize=settings.SITE_NEGATIVE_CACHE_SIZE,
+    timeout=settings.SITE_NEGATIVE_CACHE_TIMEOUT)
+_site_registry = (SiteRegistry(
+    refresh_interval=settings.SITE_REGISTRY_REFRESH_INTERVAL,
+    shared_cache=_shared_site_cache) if settings.SITE_REGISTRY else None)
+
+
+def clear_site_cache(sender=None, **kwargs): #pylint:disable=unused-argument
+    """
+    Invalidates the cached host-to-``Site`` resolutions, in this process
+    and, when ``SITE_CACHE_BACKEND`` is set, in all other processes.
+    Otherwise, other processes serve the previous row until their entries
+    expire (``SITE_CACHE_TIMEOUT``).
+
+    This is connected to ``post_save`` and ``post_delete`` on the ``Site``
+    model. Code that updates sites through ``QuerySet.update()`` bypasses
+    those signals and must call this function itself.
+
+    Caches are invalidated once the transaction commits, since requests
+    handled before then, in this process or others, would cache
+    the previous row again.
+    """
+    if _shared_site_cache is not None:
+        transaction.on_commit(_shared_site_cache.bump,
+            using=kwargs.get('using'))
+    transaction.on_commit(_site_cache.clear, using=kwargs.get('using'))
+    if _site_registry is not None:
+        instance = kwargs.get('instance')
+        if instance is not None:
+            # Copied now, since *instance* can still change (or lose its pk
+            # when deleted) before the transaction commits.
+            site = as_site_snapshot(instance)
+            if kwargs.get('signal') is post_delete:
+                transaction.on_commit(lambda: _site_registry.remove(site),
+                    using=kwargs.get('using'))
+            else:
+                transaction.on_commit(lambda: _site_registry.update(site),
+                    using=kwargs.get('using'))
+
+
+def clear_missing_site_cache(sender=None, instance=None, **kwargs):
+    #pylint:disable=unused-argument
+    """
+    Forgets, once the transaction commits, the negative lookups an active
+    *instance* would now match.
+    """
+    if instance is None:
+        transaction.on_commit(_missing_site_cache.clear,
+            using=kwargs.get('using'))
+        return
+    if not instance.is_active:
+        return
+    if instance.slug == settings.DEFAULT_SITE:
+        # The default site is a fallback for every host.
+        transaction.on_commit(_missing_site_cache.clear,
+            using=kwargs.get('using'))
+        return
+    domain = instance.domain
+    slug = instance.slug
+
+    def clear_matches():
+        for key, _ in _missing_site_cache.items():
+            host, candidate = key
+            if host == domain or candidate == slug:
+                _missing_site_cache.pop(key)
+
+    transaction.on_commit(clear_matches, using=kwargs.get('using'))
+
+
+post_save.connect(clear_site_cache,
+    sender=settings.MULTITIER_SITE_MODEL or 'multitier.Site',
+    dispatch_uid='multitier_clear_site_cache_on_save')
+post_save.connect(clear_missing_site_cache,
+    sender=settings.MULTITIER_SITE_MODEL or 'multitier.Site',
+    dispatch_uid='multitier_clear_missing_site_cache_on_save')
+post_delete.connect(clear_site_cache,
+    sender=settings.MULTITIER_SITE_MODEL or 'multitier.Site',
+    dispatch_uid='multitier_clear_site_cache_on_delete')
+post_save.connect(clear_site_secrets,
+    sender=settings.MULTITIER_SITE_MODEL or 'multitier.Site',
+    dispatch_uid='multitier_clear_site_secrets_on_save')
+post_delete.connect(clear_site_secrets,
+    sender=settings.MULTITIER_SITE_MODEL or 'multitier.Site',
+    dispatch_uid='multitier_clear_site_secrets_on_delete')
+
+
+class HostMatcher(object):
+    """
+    Extracts the candidate subdomain or path prefix of a ``Site``
+    from a request host and path.
+
+    Every entry in *allowed_hosts* (typically ``settings.ALLOWED_HOSTS``)
+    is a base domain. A host equal to a base domain selects a ``Site``
+    through the path prefix. A host ending in ``.`` followed by a base
+    domain selects a ``Site`` through its subdomain. When ``'*'`` is
+    allowed, any other host is treated as its own base domain.
+    """
+    path_prefix_re = re.compile(r'^/(?P<path_prefix>%s)' % settings.SLUG_RE)
+
+    def __init__(self, allowed_hosts):
+        self.allowed_hosts = allowed_hosts
+        self.all_host_allowed = '*' in allowed_hosts
+        base_domains = set([])
+        for allowed_host in allowed_hosts:
+            if allowed_host != '*':
+                base_domains.add(allowed_host.lower().lstrip('.'))
+        # Longest first such that the most specific base domain wins.
+        self.suffixes = tuple([('.' + base_domain, base_domain)
+            for base_domain in sorted(base_domains, key=len, reverse=True)])
+
+    def match_path_prefix(self, path):
+        # no trailing '/' is OK here.
+        look = self.path_prefix_re.match(path)
+        if look:
+            path_prefix = look.group('path_prefix')
+            return path_prefix, path_prefix, True
+        return None, '', True
+
+    def match(self, host, path):
+        """
+        Returns a tuple ``(candidate, path_prefix, with_default)`` for
+        a lower-cased *host* without port.
+        """
+        if not self.allowed_hosts:
+            return None, '', True
+        for suffix, base_domain in self.suffixes:
+            # It is either a subdomain or a path_prefix, never both.
+            if host == base_domain:
+                return self.match_path_prefix(path)
+            if host.endswith(suffix) and len(host) > len(suffix):
+                return (host[:-len(suffix)], '', self.all_host_allowed)
+        if self.all_host_allowed:
+            return self.match_path_prefix(path)
+        return None, '', False
+
+
+_host_matcher = None #pylint:disable=invalid-name
+
+
+def get_host_matcher():
+    """
+    Returns the ``HostMatcher`` for ``settings.ALLOWED_HOSTS``.
+
+    The matcher is only rebuilt when ``ALLOWED_HOSTS`` is replaced
+    (ex: through ``override_settings`` in tests).
+    """
+    global _host_matcher #pylint:disable=global-statement,invalid-name
+    allowed_hosts = django_settings.ALLOWED_HOSTS
+    matcher = _host_matcher
+    if matcher is None or matcher.allowed_hosts is not allowed_hosts:
+        matcher = HostMatcher(allowed_hosts)
+        _host_matcher = matcher
+    return matcher
+
 
 class SiteMiddleware(MiddlewareMixin):
 
+    def __init__(self, *args, **kwargs):
+        super(SiteMiddleware, self).__init__(*args, **kwargs)
+        get_host_matcher()
+
     @staticmethod
-    def as_candidate_site(request):
+    def get_candidates(request):
         """
-        Returns a ``Site`` based on the request host.
+        Returns the host, candidate slug (subdomain or path prefix),
+        path prefix for a request, and whether the default site
+        is an acceptable match.
         """
-        site = None
-        candidate = None
-        path_prefix = ''
-        all_host_allowed = False
         host = request.get_host().split(':')[0].lower()
-        app_domain = host
-        if django_settings.ALLOWED_HOSTS:
-            first_allowed_host = django_settings.ALLOWED_HOSTS[0]
-            if first_allowed_host == '*':
-                all_host_allowed = True
-            else:
-                app_domain = django_settings.ALLOWED_HOSTS[0]
-                if app_domain.startswith('.'):
-                    app_domain = app_domain[1:]
-            look = re.match(r'^((?P<subdomain>\S+)\.)?%s(?::.*)?$' % app_domain,
-                host)
-            if look and look.group('subdomain'):
-                candidate = look.group('subdomain')
-            if host == app_domain and not candidate:
-                look = re.match(r'^/(?P<path_prefix>[a-zA-Z0-9\-]+).*',
-                    request.path)
-                # no trailing '/' is OK here.
-                if look:
-                    path_prefix = look.group('path_prefix')
-                    # It is either a subdomain or a path_prefix. Trying both
-                    # match one after the other will override the candidate.
-                    if path_prefix:
-                        candidate = path_prefix
+        candidate, path_prefix, with_default = get_host_matcher().match(
+            host, request.path)
+        return host, candidate, path_prefix, with_default
+
+    @staticmethod
+    def find_site(host, candidate, path_prefix, with_default):
+        """
+        Returns a tuple ``(site, path_prefix)`` matching *host*
+        and *candidate* from the database or raises ``DoesNotExist``.
+        """
+        flt = Q(domain=host)
+        if candidate:
+            flt = flt | Q(slug=candidate)
+        if with_default:
+            flt = flt | Q(slug=settings.DEFAULT_SITE)
+        queryset = get_site_model().objects.filter(
+            flt, is_active=True).order_by('-domain', '-pk')
+        site = queryset.defer(*SITE_DEFERRED_FIELDS).first()
+        if site is None or (site.domain and site.domain != host):
+            # We return a 404 if the site is accessed through
+            # the default domain when a domain is present because
+            # a `dig domain` will return the default domain.
+            #pylint: disable=raising-bad-type
+            raise get_site_model().DoesNotExist
+        if not site.is_path_prefix or site.slug != path_prefix:
+            path_prefix = ''
+        return site, path_prefix
+
+    @classmethod
+    def as_candidate_site(cls, request):
+        """
+        Returns a ``Site`` based on the request host.
+
+        Resolutions are cached per ``(host, candidate)`` in-process
+        and, when ``SITE_CACHE_BACKEND`` is set, in a shared cache.
+        When ``SITE_REGISTRY`` is set, sites are looked up in an in-memory
+        registry of all active sites instead.
+        """
+        host, candidate, path_prefix, with_default = cls.get_candidates(
+            request)
+        if _site_registry is not None:
+            try:
+                return _site_registry.find_site(
+                    host, candidate, path_prefix, with_default)
+            except get_site_model().DoesNotExist:
+                raise Http404(cls.as_not_found_message(
+                    request, host, candidate))
+
+        def find_snapshot():
+            site, site_path_prefix = cls.find_site(
+                host, candidate, path_prefix, with_default)
+            return as_site_snapshot(site), site_path_prefix
+
+        def resolve():
+            if _shared_site_cache is not None:
+                return _shared_site_cache.get_or_resolve(
+                    (host, candidate), find_snapshot)
+            return find_snapshot()
+
+        if _shared_site_cache is not None and _shared_site_cache.poll():
+            # Another process saved a ``Site``.
+            _site_cache.clear()
+            _missing_site_cache.clear()
+            clear_site_secrets()
+        key = (host, candidate)
+        generation = _site_cache.generation
         try:
-            flt = Q(domain=host)
-            if candidate:
-                flt = flt | Q(slug=candidate)
-            if all_host_allowed or host == app_domain:
-                flt = flt | Q(slug=settings.DEFAULT_SITE)
-            queryset = get_site_model().objects.filter(
-                flt, is_active=True).order_by('-domain', '-pk')
-            site = queryset.defer(
-                'db_host_password', 'recaptcha_priv_key',
-                'social_auth_azuread_priv_key', 'social_auth_github_priv_key',
-                'social_auth_google_priv_key', 'google_api_key',
-                'processor_priv_key', 'processor_test_priv_key').first()
-            if site is None or (site.domain and site.domain != host):
-                # We return a 404 if the site is accessed through
-                # the default domain when a domain is present because
-                # a `dig domain` will return the default domain.
+            if key in _missing_site_cache:
                 #pylint: disable=raising-bad-type
                 raise get_site_model().DoesNotExist
-            if not site.is_path_prefix or site.slug != path_prefix:
-                path_prefix = ''
+            site, path_prefix = _site_cache.get_or_resolve(key, resolve)
         except get_site_model().DoesNotExist:
-            if candidate is not None:
-                msg = "'%s' nor subdomain '%s%s' could be found." % (
-                    host, candidate, django_settings.ALLOWED_HOSTS[0])
-            else:
-                msg = "'%s' could not be found." % str(host)
-            LOGGER.debug(msg, extra={'request': request})
-            raise Http404(msg)
+            if generation == _site_cache.generation:
+                # Do not record a miss if a ``Site`` was saved meanwhile.
+                _missing_site_cache.set(key, True)
+            raise Http404(cls.as_not_found_message(request, host, candidate))
         return site, path_prefix
 
+    @classmethod
+    def as_cached_candidate_site(cls, request):
+        """
+        Returns the ``(site, path_prefix)`` for a request when it can be
+        found without any I/O, otherwise ``None``.
+        """
+        if _site_registry is not None:
+            if _site_registry.loaded:
+                return cls.as_candidate_site(request)
+            return None
+        if _shared_site_cache is not None and _shared_site_cache.poll_due():
+            return None
+        host, candidate, _, _ = cls.get_candidates(request)
+        key = (host, candidate)
+        if key in _missing_site_cache:
+            raise Http404(cls.as_not_found_message(request, host, candidate))
+        return _site_cache.get(key)
+
+    @staticmethod
+    def as_not_found_message(request, host, candidate):
+        if candidate is not None:
+            msg = "'%s' nor subdomain '%s%s' could be found." % (
+                host, candidate, django_settings.ALLOWED_HOSTS[0])
+        else:
+            msg = "'%s' could not be found." % str(host)
+        LOGGER.debug(msg, extra={'request': request})
+        return msg
+
     def process_request(self, request):
         """
         Adds a ``client`` attribute to the ``request`` parameter.
         """
         clear_cache()
+        if settings.QUERY_STATS:
+            start_request_stats()
         site, path_prefix = self.as_candidate_site(request)
 
         # This is where you would typically override ``request.urlconf``
@@ -124,6 +347,38 @@ class SiteMiddleware(MiddlewareMixin):
             default_scheme=request.scheme, default_host=request.get_host(),
             request=request)
 
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        try:
+            return super(SiteMiddleware, self).__call__(request)
+        finally:
+            # Also when ``process_request`` raised ``Http404``.
+            if settings.QUERY_STATS:
+                end_request_stats(request)
+
+    async def __acall__(self, request):
+        """
+        Async version of ``__call__``. The site is resolved in the event
+        loop when it is already cached, and in a thread otherwise.
+        """
+        clear_cache()
+        if settings.QUERY_STATS:
+            start_request_stats()
+        try:
+            found = self.as_cached_candidate_site(request)
+            if found is None:
+                found = await sync_to_async(
+                    self.as_candidate_site, thread_sensitive=True)(request)
+            site, path_prefix = found
+            set_current_site(site, path_prefix,
+                default_scheme=request.scheme,
+                default_host=request.get_host(), request=request)
+            return await self.get_response(request)
+        finally:
+            if settings.QUERY_STATS:
+                end_request_stats(request)
+
 
 class SetRemoteAddrFromForwardedFor(MiddlewareMixin):
     """
@@ -28,6 +28,7 @@ Models for the multi-tier application.
 
 import json, re, string
 
+from django.conf import settings as django_settings
 from django.core.mail import get_connection as get_connection_base
 from django.core.validators import (_lazy_re_compile, RegexValidator,
     URLValidator)
@@ -40,7 +41,7 @@ from deployutils.crypt import decrypt, encrypt
 from . import settings
 from .compat import (gettext_lazy as _, import_string,
     python_2_unicode_compatible, six)
-from .thread_locals import cache_provider_db
+from .thread_locals import cache_provider_db, get_site_secret
 from .utils import get_site_model
 
 
@@ -76,6 +77,21 @@ def domain_name_validator(value):
         )
 
 
+def db_replicas_validator(value):
+    """
+    Validates that the given value is a comma-separated list of host[:port]
+    with valid port numbers.
+    """
+    if not value:
+        return
+    for replica in value.split(','):
+        db_port = replica.strip().partition(':')[2]
+        if db_port and not (db_port.isdigit() and 0 < int(db_port) < 65536):
+            raise ValidationError(
+                _("'%(replica)s' does not end with a valid port number."),
+                code='invalid', params={'replica': replica.strip()})
+
+
 def _get_encrypted_field_class():
     encrypted_class = settings.ENCRYPTED_FIELD
     if encrypted_class is None:
@@ -145,6 +161,10 @@ class BaseSite(models.Model):
     db_host_password = _get_encrypted_field_class()(
         max_length=255, null=True, blank=True,
         help_text=_("password to authenticate user connecting to the database"))
+    db_replicas = models.CharField(max_length=1024, null=True, blank=True,
+        validators=[db_replicas_validator],
+        help_text=_("comma-separated list of host[:port] of read replicas"\
+        " of the database"))
 
     # SMTP connection
     # ---------------
@@ -297,7 +317,16 @@ class BaseSite(models.Model):
         return (self.email_host_user or self.email_host_password or
             self.email_host or self.email_port)
 
-    def get_email_connection(self):
+    def get_email_connection(self, backend=None):
+        """
+        Returns an e-mail backend (defaults to ``settings.EMAIL_BACKEND``)
+        configured with the SMTP settings of the site.
+        """
+        if backend is None:
+            backend = django_settings.EMAIL_BACKEND
+        if backend == 'multitier.mailqueue.QueuedEmailBackend':
+            # Messages are sent later through the site connection.
+            return get_connection_base(backend, site=self)
         kwargs = {}
         if self.email_host:
             kwargs['host'] = self.email_host
@@ -307,7 +336,10 @@ class BaseSite(models.Model):
             kwargs['username'] = self.email_host_user
         if self.email_host_password:
             kwargs['password'] = self.get_email_host_password()
-        return get_connection_base(**kwargs)
+        if (settings.EMAIL_POOL and
+            backend == 'django.core.mail.backends.smtp.EmailBackend'):
+            backend = 'multitier.mail.PooledEmailBackend'
+        return get_connection_base(backend, **kwargs)
 
     def get_from_email(self):
         if self.email_default_from:
@@ -329,9 +361,12 @@ class BaseSite(models.Model):
             self.email_host_password = encrypted
 
     def get_email_host_password(self, passphrase=None):
-        if not passphrase:
-            passphrase = settings.SECRET_KEY
-        return decrypt(self.email_host_password, passphrase=passphrase)
+        if passphrase:
+            return decrypt(self.email_host_password, passphrase=passphrase)
+        return get_site_secret(self, 'email_host_password',
+            load=lambda: decrypt(self.email_host_password,
+                passphrase=settings.SECRET_KEY),
+            version=self.email_host_password)
 
 
 @python_2_unicode_compatible
@@ -0,0 +1,269 @@
+# Copyright (c) 2026, Djaodjin Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Per-site and per-request statistics of database queries, enabled
+with ``MULTITIER['QUERY_STATS'] = True``.
+
+An execute wrapper is installed on every new database connection. It
+records the number of queries, the time spent in them and the slowest
+statements, for the current site and for the request being served
+(see ``SiteMiddleware``). When ``QUERY_STATS_CACHE_BACKEND`` is set,
+a background thread periodically adds per-site aggregates to that Django
+cache such that ``manage.py query_stats`` can report them for all
+processes.
+"""
+
+from contextvars import ContextVar
+import atexit, heapq, logging, threading, time
+
+from django.core.cache import caches
+from django.db.backends.signals import connection_created
+
+from . import settings
+from .thread_locals import get_current_site
+
+
+LOGGER = logging.getLogger(__name__)
+
+_request_stats = ContextVar( #pylint: disable=invalid-name
+    'multitier_request_stats', default=None)
+_site_stats = {} #pylint:disable=invalid-name
+_pending_site_stats = {} #pylint:disable=invalid-name
+_lock = threading.Lock() #pylint:disable=invalid-name
+_flush_thread = None #pylint:disable=invalid-name
+
+CACHE_KEY_PREFIX = 'multitier:querystats:'
+
+
+class QueryStats(object):
+    """
+    Number of queries, total time (in seconds) and the slowest statements
+    as a list of ``(duration, sql)``.
+    """
+    __slots__ = ('count', 'duration', 'slowest')
+
+    def __init__(self, count=0, duration=0.0, slowest=None):
+        self.count = count
+        self.duration = duration
+        self.slowest = list(slowest) if slowest else []
+
+    def add(self, sql, duration):
+        self.count += 1
+        self.duration += duration
+        self.add_slowest(duration, sql)
+
+    def add_slowest(self, duration, sql):
+        # ``slowest`` is a min-heap of the statements kept.
+        if len(self.slowest) < settings.QUERY_STATS_SLOWEST:
+            heapq.heappush(self.slowest, (duration, sql))
+        elif self.slowest and duration > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, (duration, sql))
+
+    def merge(self, other):
+        self.count += other.count
+        self.duration += other.duration
+        for duration, sql in other.slowest:
+            self.add_slowest(duration, sql)
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'duration': self.duration,
+            'slowest': sorted(self.slowest, reverse=True)
+        }
+
+
+def record_query(execute, sql, params, many, context):
+    """
+    Execute wrapper that records the time spent in a query.
+    """
+    start = time.monotonic()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        duration = time.monotonic() - start
+        current_site = get_current_site()
+        slug = current_site.snapshot.slug if current_site is not None else None
+        request_stats = _request_stats.get()
+        if request_stats is not None:
+            request_stats.add(sql, duration)
+        with _lock:
+            for all_stats in (_site_stats, _pending_site_stats):
+                stats = all_stats.get(slug)
+                if stats is None:
+                    stats = QueryStats()
+                    all_stats[slug] = stats
+                stats.add(sql, duration)
+
+
+def install_record_query(sender, connection, **kwargs):
+    #pylint:disable=unused-argument
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+    if settings.QUERY_STATS_CACHE_BACKEND:
+        start_flush_thread()
+
+
+def start_flush_thread():
+    """
+    Starts the thread that adds per-site aggregates to the shared cache
+    every ``QUERY_STATS_FLUSH_INTERVAL`` seconds, such that no request
+    waits on the cache.
+    """
+    global _flush_thread #pylint:disable=global-statement,invalid-name
+    thread = _flush_thread
+    if thread is not None and thread.is_alive():
+        return
+    with _lock:
+        # The thread is not alive anymore in a forked worker process.
+        if _flush_thread is not None and _flush_thread.is_alive():
+            return
+        first = _flush_thread is None
+        _flush_thread = threading.Thread(target=_run_flush,
+            name='multitier-query-stats')
+        _flush_thread.daemon = True
+        _flush_thread.start()
+    if first:
+        atexit.register(flush_query_stats)
+
+
+def _run_flush():
+    while True:
+        time.sleep(max(settings.QUERY_STATS_FLUSH_INTERVAL, 1))
+        flush_query_stats()
+
+
+def start_request_stats():
+    """
+    Starts recording the queries of the request being served.
+    """
+    _request_stats.set(QueryStats())
+
+
+def end_request_stats(request):
+    """
+    Logs the queries recorded for *request*.
+    """
+    stats = _request_stats.get()
+    if stats is None:
+        return
+    _request_stats.set(None)
+    current_site = getattr(request, 'site', None)
+    LOGGER.info("multitier: %d queries in %.2fms for site '%s' (%s %s)",
+        stats.count, stats.duration * 1000,
+        current_site.snapshot.slug if current_site is not None else None,
+        request.method, request.path, extra={'request': request})
+    for duration, sql in sorted(stats.slowest, reverse=True):
+        LOGGER.debug("multitier: %.2fms %s", duration * 1000, sql,
+            extra={'request': request})
+
+
+def get_query_stats():
+    """
+    Returns the per-site statistics recorded by this process.
+    """
+    with _lock:
+        return {slug: stats.as_dict() for slug, stats in _site_stats.items()}
+
+
+def clear_query_stats():
+    with _lock:
+        _site_stats.clear()
+        _pending_site_stats.clear()
+
+
+def _get_cache():
+    return caches[settings.QUERY_STATS_CACHE_BACKEND]
+
+
+def _make_key(slug, name):
+    return '%s%s:%s' % (CACHE_KEY_PREFIX, slug or '', name)
+
+
+def flush_query_stats():
+    """
+    Adds the statistics recorded since the last flush to the shared cache.
+    """
+    with _lock:
+        pending = dict(_pending_site_stats)
+        _pending_site_stats.clear()
+    if not pending:
+        return
+    try:
+        cache = _get_cache()
+        sites_key = CACHE_KEY_PREFIX + 'sites'
+        slugs = set(cache.get(sites_key, []))
+        if not set(pending).issubset(slugs):
+            cache.set(sites_key, sorted(slugs | set(pending),
+                key=lambda slug: slug or ''), timeout=None)
+        for slug, stats in pending.items():
+            for name, value in (('count', stats.count),
+                    ('duration_us', int(stats.duration * 1000000))):
+                key = _make_key(slug, name)
+                cache.add(key, 0, timeout=None)
+                try:
+                    cache.incr(key, value)
+                except ValueError:
+                    # evicted in between
+                    cache.set(key, value, timeout=None)
+            # The slowest statements are merged with a read-modify-write.
+            # Concurrent flushes might lose a few entries, which is fine.
+            key = _make_key(slug, 'slowest')
+            merged = QueryStats(slowest=[tuple(item)
+                for item in cache.get(key, [])])
+            merged.merge(stats)
+            cache.set(key, merged.slowest, timeout=None)
+    except Exception as err: #pylint:disable=broad-except
+        LOGGER.warning("multitier: cannot flush query stats: %s", err)
+
+
+def get_shared_query_stats():
+    """
+    Returns the per-site statistics aggregated in the shared cache
+    by all processes.
+    """
+    cache = _get_cache()
+    results = {}
+    for slug in cache.get(CACHE_KEY_PREFIX + 'sites', []):
+        stats = QueryStats(
+            count=cache.get(_make_key(slug, 'count'), 0),
+            duration=cache.get(_make_key(slug, 'duration_us'), 0) / 1000000.0,
+            slowest=[tuple(item)
+                for item in cache.get(_make_key(slug, 'slowest'), [])])
+        results[slug] = stats.as_dict()
+    return results
+
+
+def clear_shared_query_stats():
+    cache = _get_cache()
+    slugs = cache.get(CACHE_KEY_PREFIX + 'sites', [])
+    cache.delete_many([_make_key(slug, name) for slug in slugs
+        for name in ('count', 'duration_us', 'slowest')] +
+        [CACHE_KEY_PREFIX + 'sites'])
+
+
+if settings.QUERY_STATS:
+    connection_created.connect(install_record_query,
+        dispatch_uid='multitier_record_query')
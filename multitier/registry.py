@@ -0,0 +1,202 @@
+# Copyright (c) 2026, Djaodjin Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+In-memory registry of all active sites, used by ``SiteMiddleware``
+when ``MULTITIER['SITE_REGISTRY']`` is ``True``.
+"""
+
+import logging, threading
+
+from django.db import connections
+
+from . import settings
+from .snapshots import as_site_snapshot
+from .utils import SITE_DEFERRED_FIELDS, get_site_model
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+class SiteIndex(object):
+    """
+    Immutable index of active sites (as ``SiteSnapshot``) by primary key,
+    domain and slug.
+    """
+    __slots__ = ('by_pk', 'by_domain', 'by_slug', 'watermark')
+
+    def __init__(self, sites=None):
+        by_pk = {}
+        by_domain = {}
+        by_slug = {}
+        for site in (sites or []):
+            by_pk[site.pk] = site
+        # Iterating by increasing pk mirrors the `order_by('-domain', '-pk')`
+        # of the database lookup: the most recent site wins.
+        for pk in sorted(by_pk):
+            site = by_pk[pk]
+            if site.domain:
+                by_domain[site.domain] = site
+            by_slug[site.slug] = site
+        self.by_pk = by_pk
+        self.by_domain = by_domain
+        self.by_slug = by_slug
+        self.watermark = max(by_pk) if by_pk else 0
+
+    def __len__(self):
+        return len(self.by_pk)
+
+
+class SiteRegistry(object):
+    """
+    Resolves sites with dictionary lookups into a ``SiteIndex``
+    that is swapped atomically whenever it changes.
+
+    The index is loaded on first use. A background thread then polls
+    the database every *refresh_interval* seconds for sites with a primary
+    key above the highest one seen so far. Sites saved or deleted
+    in this process are applied immediately through model signals.
+    When *shared_cache* (a ``SharedSiteCache``) is set, a change of its
+    generation counter, i.e. a ``Site`` saved by another process, triggers
+    a full reload. Without it, every refresh is a full reload.
+    """
+
+    def __init__(self, refresh_interval=60, shared_cache=None):
+        self.refresh_interval = refresh_interval
+        self.shared_cache = shared_cache
+        self._index = None
+        self._generation = None
+        self._lock = threading.RLock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    @property
+    def loaded(self):
+        return self._index is not None
+
+    @property
+    def index(self):
+        index = self._index
+        if index is None:
+            with self._lock:
+                if self._index is None:
+                    self.load()
+                    self.start()
+                index = self._index
+        return index
+
+    @staticmethod
+    def get_queryset():
+        return get_site_model().objects.filter(
+            is_active=True).defer(*SITE_DEFERRED_FIELDS)
+
+    def load(self):
+        """
+        Reloads all active sites.
+        """
+        if self.shared_cache is not None:
+            self._generation = self.shared_cache.get_generation()
+        self._index = SiteIndex([as_site_snapshot(site)
+            for site in self.get_queryset()])
+        LOGGER.debug("multitier: loaded %d sites in registry",
+            len(self._index))
+
+    def refresh(self):
+        """
+        Adds the sites created since the last refresh, or reloads
+        all active sites when another process has saved a ``Site``.
+        """
+        with self._lock:
+            if (self.shared_cache is None or
+                self.shared_cache.get_generation() != self._generation):
+                self.load()
+                return
+            index = self._index
+            added = [as_site_snapshot(site) for site in
+                self.get_queryset().filter(pk__gt=index.watermark)]
+            if added:
+                self._index = SiteIndex(list(index.by_pk.values()) + added)
+
+    def start(self):
+        if self._thread is not None or not self.refresh_interval:
+            return
+        self._thread = threading.Thread(target=self._run,
+            name='multitier-site-registry')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _run(self):
+        while not self._stopped.wait(self.refresh_interval):
+            try:
+                self.refresh()
+            except Exception as err: #pylint:disable=broad-except
+                LOGGER.exception(
+                    "multitier: cannot refresh site registry: %s", err)
+            finally:
+                # Do not hold on to database connections between refreshes.
+                connections.close_all()
+
+    def update(self, site):
+        """
+        Adds, replaces or removes (when not active) *site* in the index.
+        """
+        with self._lock:
+            index = self._index
+            if index is None:
+                return
+            by_pk = dict(index.by_pk)
+            by_pk.pop(site.pk, None)
+            if site.is_active:
+                by_pk[site.pk] = as_site_snapshot(site)
+            self._index = SiteIndex(list(by_pk.values()))
+
+    def remove(self, site):
+        with self._lock:
+            index = self._index
+            if index is None or site.pk not in index.by_pk:
+                return
+            by_pk = dict(index.by_pk)
+            del by_pk[site.pk]
+            self._index = SiteIndex(list(by_pk.values()))
+
+    def find_site(self, host, candidate, path_prefix, with_default):
+        """
+        Returns a tuple ``(site, path_prefix)`` matching *host*
+        and *candidate* or raises ``DoesNotExist``.
+        """
+        index = self.index
+        site = index.by_domain.get(host)
+        if site is None and candidate:
+            site = index.by_slug.get(candidate)
+        if site is None and with_default:
+            site = index.by_slug.get(settings.DEFAULT_SITE)
+        if site is None or (site.domain and site.domain != host):
+            #pylint: disable=raising-bad-type
+            raise get_site_model().DoesNotExist
+        if not site.is_path_prefix or site.slug != path_prefix:
+            path_prefix = ''
+        return site, path_prefix
@@ -22,50 +22,134 @@
 # OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
 # ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+from django.apps import apps as django_apps
 from django.conf import settings as django_settings
+from django.core.signals import setting_changed
 from django.db import DEFAULT_DB_ALIAS
 
 from . import settings
 from .compat import get_app_model_class, six
-from .thread_locals import get_current_site
+from .schemas import cache_schemas_db
+from .thread_locals import (check_evicted_connections, get_current_site,
+    get_replica_db, pin_primary_db)
+
+
+_UNSET = object()
+_multitier_name = _UNSET #pylint:disable=invalid-name
+
+
+def get_multitier_name():
+    """
+    Returns ``settings.MULTITIER_NAME``, or ``None`` when it is not defined.
+    """
+    global _multitier_name #pylint:disable=global-statement,invalid-name
+    if _multitier_name is _UNSET:
+        _multitier_name = getattr(django_settings, 'MULTITIER_NAME', None)
+    return _multitier_name
+
+
+def reset_multitier_name(setting, **kwargs): #pylint:disable=unused-argument
+    global _multitier_name #pylint:disable=global-statement,invalid-name
+    if setting == 'MULTITIER_NAME':
+        _multitier_name = _UNSET
+
+setting_changed.connect(reset_multitier_name,
+    dispatch_uid='multitier_reset_multitier_name')
 
 
 class SiteRouter(object):
     """
     A router to control all database operations on Django models in a set
     of ``apps`` and SQL tables in a set of ``tables``.
+
+    Whether a model is routed is computed once, the first time the router
+    sees it, and stored in ``routing_table`` keyed by model class, label
+    (``app_label.model_name``) and app label.
     """
     #pylint: disable=protected-access
 
     apps = settings.ROUTER_APPS
     tables = settings.ROUTER_TABLES
 
+    def __init__(self):
+        self.apps = frozenset(self.apps)
+        self.tables = frozenset(self.tables)
+        self.routing_table = {}
+
     @staticmethod
     def provider_db():
-        if hasattr(django_settings, 'MULTITIER_NAME'):
+        # Queries might run in a different thread than the one that
+        # activated the site (ex: ``sync_to_async`` under ASGI).
+        check_evicted_connections()
+        multitier_name = get_multitier_name()
+        if multitier_name is not None:
             # ``manage.py loaddata`` will call db_for_write for relation
             # tables. Since we don't have a ``request`` then, we rely
             # on an environment variable.
-            return django_settings.MULTITIER_NAME
+            if settings.DB_SCHEMAS:
+                return cache_schemas_db()
+            return multitier_name
         current_site = get_current_site()
         if current_site:
-            return current_site.db_name
+            # The snapshot is shared by all queries of a request.
+            db_name = current_site.snapshot.db_name
+            if db_name and settings.DB_SCHEMAS:
+                # All sites share one database alias. Queries are
+                # directed to the site schema by ``schemas``.
+                return cache_schemas_db()
+            return db_name
         return DEFAULT_DB_ALIAS
 
-    def includes(self, model):
-        if isinstance(model, six.string_types):
-            return model in self.apps
+    def load_routing_table(self):
+        """
+        Fills ``routing_table`` for all installed models.
+        """
+        routing_table = {}
+        for model in django_apps.get_models(include_auto_created=True):
+            routing_table[model] = routing_table[model._meta.label_lower] = (
+                self.includes_model(model))
+        for app_config in django_apps.get_app_configs():
+            routing_table[app_config.label] = app_config.label in self.apps
+        self.routing_table.update(routing_table)
+
+    def includes_model(self, model):
         return (model._meta.app_label in self.apps
                 or model._meta.db_table in self.tables)
 
+    def includes(self, model):
+        try:
+            return self.routing_table[model]
+        except KeyError:
+            pass
+        except TypeError:
+            # not hashable
+            return self.includes_model(model)
+        if isinstance(model, six.string_types):
+            result = model in self.apps
+        else:
+            if not self.routing_table:
+                self.load_routing_table()
+                if model in self.routing_table:
+                    return self.routing_table[model]
+            result = self.includes_model(model)
+            if model._meta.apps is not django_apps:
+                # Historical models created by migrations are not
+                # kept around.
+                return result
+        self.routing_table[model] = result
+        return result
+
 
     def db_for_read(self, model, **hints): #pylint: disable=unused-argument
         """
-        Attempts to read ``apps`` models go to the current provider.
+        Attempts to read ``apps`` models go to the current provider,
+        or one of its read replicas.
         """
         result = None
         if self.includes(model):
             result = self.provider_db()
+            if result != DEFAULT_DB_ALIAS:
+                result = get_replica_db(result) or result
         return result
 
     def db_for_write(self, model, **hints): #pylint: disable=unused-argument
@@ -75,6 +159,9 @@ class SiteRouter(object):
         result = None
         if self.includes(model):
             result = self.provider_db()
+            if result != DEFAULT_DB_ALIAS:
+                # Reads that follow must see the write.
+                pin_primary_db()
         return result
 
     def allow_relation(self, obj1, obj2, **hints):
@@ -98,7 +185,12 @@ class SiteRouter(object):
         model = hints.get('model')
         if model is None:
             if model_name is not None:
-                model = get_app_model_class(app_label, model_name)
+                model = '%s.%s' % (app_label, model_name.lower())
+                if model not in self.routing_table:
+                    if not self.routing_table:
+                        self.load_routing_table()
+                    if model not in self.routing_table:
+                        model = get_app_model_class(app_label, model_name)
             else:
                 # Django 1.7 prototype is allow_migrate(self, db, model)
                 model = app_label
@@ -0,0 +1,152 @@
+# Copyright (c) 2026, Djaodjin Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Schema-per-site mode, enabled with ``MULTITIER['DB_SCHEMAS'] = True``
+(PostgreSQL only).
+
+Models in ``ROUTER_APPS`` of all sites with a ``db_name`` are routed
+to a single database alias (``SCHEMAS_DB_ALIAS``), a copy of ``default``,
+such that they share its connections (or connection pool). Before a query
+runs, the ``search_path`` of the connection is set to the schema named
+after ``Site.db_name`` of the current site. It does not include ``public``
+such that each schema has its own ``django_migrations`` table.
+
+A site schema is created with ``create_schema`` and its tables with
+``migrate --database=multitier_schemas`` inside ``site_context``, which
+``run_for_sites migrate`` does for each site.
+"""
+
+import functools, logging
+
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.backends.signals import connection_created
+
+from .thread_locals import as_provider_db, get_current_site
+
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_SCHEMA = 'public'
+SCHEMAS_DB_ALIAS = 'multitier_schemas'
+
+
+def cache_schemas_db():
+    """
+    Adds the database alias shared by all site schemas
+    to ``connections.databases``, if it is not already defined,
+    and returns it.
+    """
+    if SCHEMAS_DB_ALIAS not in connections.databases:
+        connections.databases[SCHEMAS_DB_ALIAS] = as_provider_db(
+            connections.databases[DEFAULT_DB_ALIAS]['NAME'])
+    return SCHEMAS_DB_ALIAS
+
+
+def create_schema(schema):
+    """
+    Creates the schema *schema* when it does not exist yet.
+    """
+    connection = connections[cache_schemas_db()]
+    with connection.cursor() as cursor:
+        cursor.execute("CREATE SCHEMA IF NOT EXISTS %s" %
+            connection.ops.quote_name(schema))
+
+
+def get_current_schema():
+    """
+    Returns the schema of the current site, or ``public`` when there is
+    no current site or it does not define a ``db_name``.
+    """
+    #pylint:disable=import-outside-toplevel
+    from .routers import get_multitier_name
+    multitier_name = get_multitier_name()
+    if multitier_name is not None:
+        # Same as in ``SiteRouter.provider_db``.
+        return multitier_name
+    current_site = get_current_site()
+    if current_site is not None and current_site.snapshot.db_name:
+        return current_site.snapshot.db_name
+    return DEFAULT_SCHEMA
+
+
+def set_search_path(connection, schema):
+    """
+    Sets the ``search_path`` of *connection* to *schema*.
+    """
+    sql = "SET search_path TO %s" % connection.ops.quote_name(schema)
+    LOGGER.debug("multitier: %s", sql)
+    # Bypasses the execute wrappers.
+    with connection.wrap_database_errors:
+        with connection.connection.cursor() as raw_cursor:
+            raw_cursor.execute(sql)
+    connection.multitier_schema = schema
+
+
+def search_path_wrapper(execute, sql, params, many, context):
+    """
+    Execute wrapper that switches the schema of the connection
+    to the one of the current site when they differ.
+    """
+    connection = context['connection']
+    schema = get_current_schema()
+    if connection.multitier_schema != schema:
+        set_search_path(connection, schema)
+    return execute(sql, params, many, context)
+
+
+def _forget_search_path_on(connection, name):
+    # A rollback (to a savepoint) undoes a ``SET`` made after
+    # the transaction (or savepoint) started.
+    method = getattr(connection, name)
+
+    @functools.wraps(method)
+    def forget_search_path(*args, **kwargs):
+        try:
+            return method(*args, **kwargs)
+        finally:
+            connection.multitier_schema = None
+
+    setattr(connection, name, forget_search_path)
+
+
+def install_search_path_wrapper(sender, connection, **kwargs):
+    #pylint:disable=unused-argument
+    """
+    Called for every new connection to ``SCHEMAS_DB_ALIAS``.
+    """
+    if connection.alias != SCHEMAS_DB_ALIAS:
+        return
+    # The search_path of a new session is the server default.
+    connection.multitier_schema = None
+    if search_path_wrapper not in connection.execute_wrappers:
+        # ``execute_wrappers`` lives as long as the ``DatabaseWrapper``,
+        # i.e. across reconnects.
+        connection.execute_wrappers.append(search_path_wrapper)
+        _forget_search_path_on(connection, 'rollback')
+        _forget_search_path_on(connection, 'savepoint_rollback')
+
+
+connection_created.connect(install_search_path_wrapper,
+    dispatch_uid='multitier_search_path')
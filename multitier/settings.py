@@ -40,18 +40,53 @@ _SETTINGS = {
     'ACCOUNT_MODEL': settings.AUTH_USER_MODEL,
     'ACCOUNT_GET_CURRENT': None,
     'ACCOUNT_URL_KWARG': None,
+    'DB_ALIASES_MAX': 128,
+    'DB_POOL': None,
+    'DB_SCHEMAS': False,
     'DEBUG_SQLITE3_PATHS': [],
     'DEFAULT_DOMAIN': 'localhost:8000',
     'DEFAULT_SITE': getattr(settings, 'APP_NAME', 'default'),
     'DEFAULT_URLS': [],
     'DEFAULT_FROM_EMAIL': settings.DEFAULT_FROM_EMAIL,
+    'EMAIL_POOL': False,
+    'EMAIL_POOL_IDLE_TIMEOUT': 60,
+    'EMAIL_POOL_KEEPALIVE_INTERVAL': 15,
+    'EMAIL_POOL_SIZE': 4,
+    'EMAIL_POOL_WAIT_TIMEOUT': 30,
+    'EMAIL_QUEUE_BACKEND': 'django.core.mail.backends.smtp.EmailBackend',
+    'EMAIL_QUEUE_BATCH_SIZE': 100,
+    'EMAIL_QUEUE_INTERVAL': 5,
+    'EMAIL_QUEUE_MAX_ATTEMPTS': 5,
+    'EMAIL_QUEUE_PATH': os.path.join(settings.BASE_DIR, 'mail-spool.sqlite'),
+    'EMAIL_QUEUE_RATE_LIMIT': None,
+    'EMAIL_QUEUE_RETRY_DELAY': 60,
+    'EMAIL_QUEUE_WORKER': True,
     'ENCRYPTED_FIELD': None,
+    'MIGRATION_INDEX': None,
+    'QUERY_STATS': False,
+    'QUERY_STATS_CACHE_BACKEND': None,
+    'QUERY_STATS_FLUSH_INTERVAL': 60,
+    'QUERY_STATS_SLOWEST': 5,
     'ROUTER_APPS': ('auth', 'sessions', 'contenttypes'),
     'ROUTER_TABLES': [],
     'THEMES_DIRS': [os.path.join(settings.BASE_DIR, 'themes')],
     'STATICFILES_DIRS': (tuple(settings.STATICFILES_DIRS) +
         ((settings.STATIC_ROOT,) if settings.STATIC_ROOT else tuple([]))),
-    'SECRET_KEY': settings.SECRET_KEY
+    'SECRET_KEY': settings.SECRET_KEY,
+    'SITE_CACHE_BACKEND': None,
+    'SITE_CACHE_POLL_INTERVAL': 5,
+    'SITE_CACHE_SIZE': 1024,
+    'SITE_CACHE_TIMEOUT': 60,
+    'SITE_NEGATIVE_CACHE_SIZE': 4096,
+    'SITE_NEGATIVE_CACHE_TIMEOUT': 60,
+    'SITE_REGISTRY': False,
+    'SITE_REGISTRY_REFRESH_INTERVAL': 60,
+    'SITE_SECRETS_CACHE_SIZE': 1024,
+    'SITE_SECRETS_CACHE_TIMEOUT': 300,
+    'TEMPLATE_CACHE_CHECK_MTIME': settings.DEBUG,
+    'TEMPLATE_CACHE_SIZE': 1024,
+    'TEMPLATE_INDEX': False,
+    'TEMPLATE_INDEX_REFRESH_INTERVAL': 5,
 }
 _SETTINGS.update(getattr(settings, 'MULTITIER', {}))
 
@@ -60,14 +95,51 @@ SLUG_RE = r'[a-zA-Z0-9\-]+'
 ACCOUNT_GET_CURRENT = _SETTINGS.get('ACCOUNT_GET_CURRENT')
 ACCOUNT_MODEL = _SETTINGS.get('ACCOUNT_MODEL')
 ACCOUNT_URL_KWARG = _SETTINGS.get('ACCOUNT_URL_KWARG')
+DB_ALIASES_MAX = _SETTINGS.get('DB_ALIASES_MAX')
+DB_POOL = _SETTINGS.get('DB_POOL')
+DB_SCHEMAS = _SETTINGS.get('DB_SCHEMAS')
 DEBUG_SQLITE3_PATHS = _SETTINGS.get('DEBUG_SQLITE3_PATHS')
 DEFAULT_DOMAIN = _SETTINGS.get('DEFAULT_DOMAIN')
 DEFAULT_FROM_EMAIL = _SETTINGS.get('DEFAULT_FROM_EMAIL')
 DEFAULT_SITE = _SETTINGS.get('DEFAULT_SITE')
 DEFAULT_URLS = _SETTINGS.get('DEFAULT_URLS')
+EMAIL_POOL = _SETTINGS.get('EMAIL_POOL')
+EMAIL_POOL_IDLE_TIMEOUT = _SETTINGS.get('EMAIL_POOL_IDLE_TIMEOUT')
+EMAIL_POOL_KEEPALIVE_INTERVAL = _SETTINGS.get('EMAIL_POOL_KEEPALIVE_INTERVAL')
+EMAIL_POOL_SIZE = _SETTINGS.get('EMAIL_POOL_SIZE')
+EMAIL_POOL_WAIT_TIMEOUT = _SETTINGS.get('EMAIL_POOL_WAIT_TIMEOUT')
+EMAIL_QUEUE_BACKEND = _SETTINGS.get('EMAIL_QUEUE_BACKEND')
+EMAIL_QUEUE_BATCH_SIZE = _SETTINGS.get('EMAIL_QUEUE_BATCH_SIZE')
+EMAIL_QUEUE_INTERVAL = _SETTINGS.get('EMAIL_QUEUE_INTERVAL')
+EMAIL_QUEUE_MAX_ATTEMPTS = _SETTINGS.get('EMAIL_QUEUE_MAX_ATTEMPTS')
+EMAIL_QUEUE_PATH = _SETTINGS.get('EMAIL_QUEUE_PATH')
+EMAIL_QUEUE_RATE_LIMIT = _SETTINGS.get('EMAIL_QUEUE_RATE_LIMIT')
+EMAIL_QUEUE_RETRY_DELAY = _SETTINGS.get('EMAIL_QUEUE_RETRY_DELAY')
+EMAIL_QUEUE_WORKER = _SETTINGS.get('EMAIL_QUEUE_WORKER')
 ENCRYPTED_FIELD = _SETTINGS.get('ENCRYPTED_FIELD')
+MIGRATION_INDEX = _SETTINGS.get('MIGRATION_INDEX')
+QUERY_STATS = _SETTINGS.get('QUERY_STATS')
+QUERY_STATS_CACHE_BACKEND = _SETTINGS.get('QUERY_STATS_CACHE_BACKEND')
+QUERY_STATS_FLUSH_INTERVAL = _SETTINGS.get('QUERY_STATS_FLUSH_INTERVAL')
+QUERY_STATS_SLOWEST = _SETTINGS.get('QUERY_STATS_SLOWEST')
 ROUTER_APPS = _SETTINGS.get('ROUTER_APPS')
 ROUTER_TABLES = _SETTINGS.get('ROUTER_TABLES')
 SECRET_KEY = _SETTINGS.get('SECRET_KEY')
+SITE_CACHE_BACKEND = _SETTINGS.get('SITE_CACHE_BACKEND')
+SITE_CACHE_POLL_INTERVAL = _SETTINGS.get('SITE_CACHE_POLL_INTERVAL')
+SITE_CACHE_SIZE = _SETTINGS.get('SITE_CACHE_SIZE')
+SITE_CACHE_TIMEOUT = _SETTINGS.get('SITE_CACHE_TIMEOUT')
+SITE_NEGATIVE_CACHE_SIZE = _SETTINGS.get('SITE_NEGATIVE_CACHE_SIZE')
+SITE_NEGATIVE_CACHE_TIMEOUT = _SETTINGS.get('SITE_NEGATIVE_CACHE_TIMEOUT')
+SITE_REGISTRY = _SETTINGS.get('SITE_REGISTRY')
+SITE_REGISTRY_REFRESH_INTERVAL = _SETTINGS.get(
+    'SITE_REGISTRY_REFRESH_INTERVAL')
+SITE_SECRETS_CACHE_SIZE = _SETTINGS.get('SITE_SECRETS_CACHE_SIZE')
+SITE_SECRETS_CACHE_TIMEOUT = _SETTINGS.get('SITE_SECRETS_CACHE_TIMEOUT')
 STATICFILES_DIRS = _SETTINGS.get('STATICFILES_DIRS')
+TEMPLATE_CACHE_CHECK_MTIME = _SETTINGS.get('TEMPLATE_CACHE_CHECK_MTIME')
+TEMPLATE_CACHE_SIZE = _SETTINGS.get('TEMPLATE_CACHE_SIZE')
+TEMPLATE_INDEX = _SETTINGS.get('TEMPLATE_INDEX')
+TEMPLATE_INDEX_REFRESH_INTERVAL = _SETTINGS.get(
+    'TEMPLATE_INDEX_REFRESH_INTERVAL')
 THEMES_DIRS = _SETTINGS.get('THEMES_DIRS')
@@ -0,0 +1,225 @@
+# Copyright (c) 2026, Djaodjin Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Compact, immutable copies of ``Site`` rows used on the request path.
+"""
+
+from types import MappingProxyType
+
+from .utils import SITE_DEFERRED_FIELDS
+
+
+_UNSET = object()
+
+
+def _get_slot(obj, name):
+    # Bypasses ``__getattr__`` such that reading an unset slot does not
+    # trigger loading ``db_object``.
+    try:
+        return object.__getattribute__(obj, name)
+    except AttributeError:
+        return _UNSET
+
+
+# Fields of ``BaseSite`` needed to route requests and to answer
+# the settings getters in ``thread_locals``.
+SNAPSHOT_FIELDS = (
+    'slug', 'domain', 'is_path_prefix', 'cors_restricted', 'cert_location',
+    'account_id', 'is_active', 'extra',
+    'db_name', 'db_host', 'db_port', 'db_host_user', 'db_replicas',
+    'email_default_from', 'email_host', 'email_port', 'email_host_user',
+    'email_host_password',
+    'authentication', 'registration',
+    'registration_requires_recaptcha', 'contact_requires_recaptcha',
+    'recaptcha_pub_key',
+    'social_auth_azuread_pub_key', 'social_auth_github_pub_key',
+    'social_auth_google_pub_key',
+    'processor_is_platform', 'processor_pub_key', 'processor_client_key',
+    'connect_callback_url', 'enables_processor_test_keys',
+    'processor_test_pub_key', 'processor_test_client_key',
+    'connect_test_callback_url',
+    'notification_webhook_url', 'notification_email_disabled',
+)
+
+# Settings of a site returned by the ``thread_locals`` getters,
+# with their value when there is no current site.
+DEFAULT_SITE_SETTINGS = MappingProxyType({
+    'default_from_email': "",
+    'authentication': 0,
+    'registration': 0,
+    'registration_requires_recaptcha': False,
+    'contact_requires_recaptcha': False,
+    'recaptcha_pub_key': "",
+    'social_auth_azuread_pub_key': "",
+    'social_auth_github_pub_key': "",
+    'social_auth_google_pub_key': "",
+    'processor_is_platform': False,
+    'processor_pub_key': "",
+    'processor_client_key': "",
+    'connect_callback_url': "",
+    'enables_processor_test_keys': False,
+    'processor_test_pub_key': "",
+    'processor_test_client_key': "",
+    'connect_test_callback_url': "",
+    'notification_webhook_url': "",
+    'notification_email_disabled': False,
+})
+
+
+class SiteSnapshot(object):
+    """
+    Frozen copy of the routing and settings fields of a ``Site``.
+
+    Any other attribute or method, including the encrypted secret fields,
+    is looked up on a model instance re-created from the snapshot itself
+    (see ``as_db_object``). Secret fields are loaded from the database
+    by Django when they are read.
+
+    Snapshots are shared by all requests for a site. Code that needs
+    a ``Site`` it can modify uses ``CurrentSite.db_object`` instead.
+    """
+    __slots__ = SNAPSHOT_FIELDS + ('pk', '_model', '_db', '_extra',
+        '_settings')
+
+    def __init__(self, site):
+        setter = object.__setattr__
+        loaded = site.__dict__
+        for field_name in SNAPSHOT_FIELDS:
+            if field_name in loaded:
+                setter(self, field_name, loaded[field_name])
+        setter(self, 'pk', site.pk)
+        setter(self, '_model', site.__class__)
+        setter(self, '_db', site._state.db) #pylint:disable=protected-access
+        # Fields added by a project-specific ``Site`` model.
+        extra = {}
+        for field in site._meta.concrete_fields: #pylint:disable=protected-access
+            attname = field.attname
+            if (attname in loaded and not field.primary_key and
+                attname not in SNAPSHOT_FIELDS and
+                attname not in SITE_DEFERRED_FIELDS):
+                extra[attname] = loaded[attname]
+        setter(self, '_extra', extra)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("'%s' is immutable" % self.__class__.__name__)
+
+    def __getattr__(self, name):
+        # Only called when `name` is not a loaded slot.
+        if name.startswith('__') or name in ('pk', '_model', '_db', '_extra',
+                '_settings'):
+            raise AttributeError(name)
+        return getattr(self.as_db_object(), name)
+
+    def __getstate__(self):
+        state = {}
+        for name in SiteSnapshot.__slots__:
+            value = _get_slot(self, name)
+            if name != '_settings' and value is not _UNSET:
+                state[name] = value
+        return state
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            object.__setattr__(self, name, value)
+
+    def __eq__(self, other):
+        if isinstance(other, SiteSnapshot):
+            return self._model is other._model and self.pk == other.pk
+        if isinstance(other, self._model):
+            return self.pk == other.pk
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    def __hash__(self):
+        return hash(self.pk)
+
+    def __str__(self):
+        return str(self.as_db_object())
+
+    def __repr__(self):
+        return '<%s: %s>' % (self.__class__.__name__, self.slug)
+
+    @property
+    def settings(self):
+        """
+        Read-only mapping with the keys of ``DEFAULT_SITE_SETTINGS``,
+        computed once per snapshot.
+        """
+        site_settings = _get_slot(self, '_settings')
+        if site_settings is _UNSET:
+            values = {}
+            for key, default in DEFAULT_SITE_SETTINGS.items():
+                if key == 'default_from_email':
+                    value = self.email_default_from
+                    if not value:
+                        value = self.email_host_user
+                        if not value or '@' not in value:
+                            value = default
+                else:
+                    value = getattr(self, key)
+                    if not value and isinstance(default, str):
+                        value = default
+                values[key] = value
+            site_settings = MappingProxyType(values)
+            object.__setattr__(self, '_settings', site_settings)
+        return site_settings
+
+    def as_db_object(self):
+        """
+        Returns a new model instance equivalent to this snapshot.
+        """
+        model = self._model
+        field_names = []
+        values = []
+        for field in model._meta.concrete_fields: #pylint:disable=protected-access
+            attname = field.attname
+            if field.primary_key:
+                value = self.pk
+            elif attname in self._extra:
+                value = self._extra[attname]
+            elif attname in SNAPSHOT_FIELDS:
+                value = _get_slot(self, attname)
+                if value is _UNSET:
+                    continue
+            else:
+                continue
+            field_names.append(attname)
+            values.append(value)
+        return model.from_db(self._db, field_names, values)
+
+
+def as_site_snapshot(site):
+    """
+    Returns a ``SiteSnapshot`` for *site*, which can be a ``Site``
+    model instance or already a snapshot.
+    """
+    if site is None or isinstance(site, SiteSnapshot):
+        return site
+    return SiteSnapshot(site)
@@ -22,42 +22,106 @@
 # OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
 # ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
-import logging, os
-
-from django.db import connections
+import itertools, logging, os, threading, weakref
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import django
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import request_finished
+from django.db import connections, transaction
+from django.db.backends.signals import connection_created
 from django.db.utils import DEFAULT_DB_ALIAS
 from django.utils.encoding import iri_to_uri
+from django.utils.translation import get_language, override
 
 from . import settings
-from .compat import python_2_unicode_compatible, reverse, urljoin, urlparse
-
-try:
-    from threading import local
-except ImportError:
-    #pylint: disable=import-error,no-name-in-module
-    from django.utils._threading_local import local
-
-_thread_locals = local() #pylint: disable=invalid-name
+from .caches import LRUCache, SecretsCache
+from .compat import (get_script_prefix, get_urlconf,
+    python_2_unicode_compatible, reverse, urljoin, urlparse)
+from .snapshots import DEFAULT_SITE_SETTINGS, as_site_snapshot
+
+# Despite the module name, the current site is stored in a context variable
+# such that concurrent requests served by the same thread (ASGI) do not
+# see each other's site.
+_current_site = ContextVar( #pylint: disable=invalid-name
+    'multitier_current_site', default=None)
+
+# Site-specific database aliases added to ``connections.databases``.
+#pylint:disable=invalid-name
+_provider_dbs = LRUCache(maxsize=settings.DB_ALIASES_MAX)
+# Aliases removed from ``connections.databases`` that some threads
+# still have a connection to.
+_evicted_provider_dbs = set([])
+_provider_dbs_local = threading.local()
+_provider_dbs_lock = threading.RLock()
+_provider_dbs_evictions = 0
+# Number of live ``CurrentSite`` using each alias. An alias in use is
+# never removed from ``connections.databases``. When it is evicted from
+# ``_provider_dbs``, it is removed once it is not in use anymore.
+_provider_dbs_refs = {}
+_deferred_provider_dbs = set([])
+# Number of connection wrappers (one per thread) to each alias.
+_provider_dbs_connections = {}
+#pylint:enable=invalid-name
+
+# Read replicas of site-specific databases, and the ``CurrentSite`` whose
+# reads have been pinned to the primary database after a write.
+_replica_dbs = LRUCache(maxsize=1024) #pylint:disable=invalid-name
+_pinned_site = ContextVar( #pylint: disable=invalid-name
+    'multitier_pinned_site', default=None)
+
+# Decrypted values of encrypted ``Site`` fields.
+_site_secrets = SecretsCache( #pylint:disable=invalid-name
+    maxsize=settings.SITE_SECRETS_CACHE_SIZE,
+    timeout=settings.SITE_SECRETS_CACHE_TIMEOUT)
 
 LOGGER = logging.getLogger(__name__)
 
 
 @python_2_unicode_compatible
 class CurrentSite(object):
+    """
+    The ``Site``, as a ``SiteSnapshot``, and path prefix a request is
+    handled for. Fields of the snapshot are read from it. Any other
+    attribute is looked up on ``db_object``.
+    """
+    __slots__ = ('snapshot', 'path_prefix', 'default_scheme', 'default_host',
+        'site_settings', '_db_object', '__weakref__')
 
     def __init__(self, site, path_prefix,
                  default_scheme='http', default_host='localhost'):
-        self.db_object = site
+        self.snapshot = as_site_snapshot(site)
+        # A model instance passed by the caller is used as-is.
+        self._db_object = site if site is not self.snapshot else None
+        self.site_settings = self.snapshot.settings
         self.path_prefix = path_prefix
         self.default_scheme = default_scheme
         self.default_host = default_host
 
     def __getattr__(self, name):
-        return getattr(self.db_object, name)
+        if name in CurrentSite.__slots__:
+            raise AttributeError(name)
+        try:
+            # Bypasses ``SiteSnapshot.__getattr__``, which would create
+            # a model instance on each call.
+            return object.__getattribute__(self.snapshot, name)
+        except AttributeError:
+            return getattr(self.db_object, name)
 
     def __str__(self):
         return self.db_object.__str__()
 
+    @property
+    def db_object(self):
+        """
+        Model instance for the site, created on first access. It is not
+        shared with other requests, so callers are free to modify it.
+        """
+        if self._db_object is None:
+            self._db_object = self.snapshot.as_db_object()
+        return self._db_object
+
     def as_absolute_uri(self, location='/'):
         parts = urlparse(location)
         if parts.scheme and parts.netloc:
@@ -65,8 +129,8 @@ class CurrentSite(object):
             # to do and just return it "as is".
             return location
 
-        if self.db_object.domain:
-            host = self.db_object.domain
+        if self.snapshot.domain:
+            host = self.snapshot.domain
         else:
             host = self.default_host
             if self.path_prefix:
@@ -92,6 +156,12 @@ def as_provider_db(db_name, db_host=None, db_port=None):
         provider_db.update({'HOST':db_host})
     if db_port:
         provider_db.update({'PORT':db_port})
+    if settings.DB_POOL:
+        provider_db['OPTIONS'] = as_provider_db_pool_options(
+            provider_db.get('OPTIONS', {}))
+        # Pooled connections are returned to the pool at the end of each
+        # request. Django rejects pools with persistent connections.
+        provider_db['CONN_MAX_AGE'] = 0
     if provider_db['ENGINE'].endswith('sqlite3'):
         # HACK to set absolute paths (used in development environments)
         candidates = [os.path.join(dir_path, db_name + '.sqlite')
@@ -110,27 +180,418 @@ def as_provider_db(db_name, db_host=None, db_port=None):
     return provider_db
 
 
-def cache_provider_db(db_name, db_host=None, db_port=None):
+def check_db_pool_settings():
+    """
+    Raises ``ImproperlyConfigured`` when ``MULTITIER['DB_POOL']`` is set
+    but cannot be used. This is called when this module is loaded, such
+    that a misconfiguration is reported on startup.
+    """
+    if not settings.DB_POOL:
+        return
+    engine = connections.databases[DEFAULT_DB_ALIAS]['ENGINE']
+    if not engine.endswith('postgresql') or django.VERSION < (5, 1):
+        raise ImproperlyConfigured("MULTITIER['DB_POOL'] requires"\
+            " the PostgreSQL backend and Django 5.1+ (got '%s' with"\
+            " Django %s)" % (engine, django.get_version()))
+    if settings.DB_ALIASES_MAX is None:
+        raise ImproperlyConfigured("MULTITIER['DB_POOL'] requires"\
+            " MULTITIER['DB_ALIASES_MAX'] to bound the number of pools")
+
+check_db_pool_settings()
+
+
+def check_db_schemas_settings():
+    """
+    Raises ``ImproperlyConfigured`` when ``MULTITIER['DB_SCHEMAS']``
+    is set but the default database is not PostgreSQL.
+    """
+    if not settings.DB_SCHEMAS:
+        return
+    engine = connections.databases[DEFAULT_DB_ALIAS]['ENGINE']
+    if not engine.endswith('postgresql'):
+        # SQLite ``ATTACH`` does not redirect unqualified table names
+        # when the main database has tables with the same names.
+        raise ImproperlyConfigured("MULTITIER['DB_SCHEMAS'] requires"\
+            " the PostgreSQL backend (got '%s')" % engine)
+
+check_db_schemas_settings()
+
+
+def as_provider_db_pool_options(options):
+    """
+    Returns a copy of *options* which enables the connection pool
+    defined by ``MULTITIER['DB_POOL']``.
+
+    Threads then share a bounded set of connections to each site-specific
+    database instead of keeping one connection per thread open. At most
+    ``max_size`` connections are open to each database, and at most
+    ``DB_ALIASES_MAX`` pools are open, which bounds the total number
+    of connections to site-specific databases.
+    """
+    options = dict(options)
+    if 'pool' not in options:
+        pool = settings.DB_POOL
+        options['pool'] = dict(pool) if isinstance(pool, dict) else True
+    return options
+
+
+def close_provider_db_pool(alias):
+    """
+    Closes the connection pool for *alias*, if any.
+    """
+    pools = _get_connection_pools()
+    pool = pools.pop(alias, None)
+    if pool is not None:
+        LOGGER.debug("multitier: close connection pool for '%s'", alias)
+        pool.close()
+
+
+def _get_connection_pools():
+    if not settings.DB_POOL or django.VERSION < (5, 1):
+        return {}
+    try:
+        #pylint:disable=import-outside-toplevel
+        from django.db.backends.postgresql.base import DatabaseWrapper
+    except Exception: #pylint:disable=broad-except
+        # psycopg is not installed.
+        return {}
+    return DatabaseWrapper._connection_pools #pylint:disable=protected-access
+
+
+def _evict_provider_db(alias):
+    # Must be called with `_provider_dbs_lock` held.
+    global _provider_dbs_evictions #pylint:disable=global-statement
+    LOGGER.debug("multitier: evict database '%s'", alias)
+    connections.databases.pop(alias, None)
+    if _provider_dbs_connections.get(alias):
+        _evicted_provider_dbs.add(alias)
+    _provider_dbs_evictions += 1
+
+
+def cache_provider_db(db_name, db_host=None, db_port=None, alias=None):
+    """
+    Adds the site-specific database *db_name* to ``connections.databases``,
+    under *alias* (defaults to *db_name*), if it is not already defined.
+
+    At most ``MULTITIER['DB_ALIASES_MAX']`` (128 by default, ``None``
+    for no bound) aliases are kept. The least recently used aliases added
+    here are removed to stay within that bound, unless a current site still
+    uses them (see ``hold_provider_dbs``). Each thread closes its connections
+    to removed aliases the next time it activates a site, routes a query
+    or finishes a request (see ``check_evicted_connections``).
+    """
     if not db_name:
         return None
-    if not db_name in connections.databases:
-        connections.databases[db_name] = as_provider_db(db_name,
-            db_host=db_host, db_port=db_port)
-    return connections.databases[db_name]
+    if alias is None:
+        alias = db_name
+    if _provider_dbs.get(alias) is None:
+        evicted = []
+        with _provider_dbs_lock:
+            if alias in _deferred_provider_dbs:
+                # Used again before it could be removed.
+                _deferred_provider_dbs.discard(alias)
+                evicted = _provider_dbs.set(alias, True)
+            elif not alias in connections.databases:
+                _evicted_provider_dbs.discard(alias)
+                provider_db = as_provider_db(db_name,
+                    db_host=db_host, db_port=db_port)
+                if alias != db_name:
+                    # Read replica of *db_name*
+                    provider_db['TEST'] = dict(provider_db.get('TEST', {}),
+                        MIRROR=db_name)
+                connections.databases[alias] = provider_db
+                evicted = _provider_dbs.set(alias, True)
+            removed = []
+            for evicted_alias, _ in evicted:
+                if _provider_dbs_refs.get(evicted_alias):
+                    _deferred_provider_dbs.add(evicted_alias)
+                else:
+                    _evict_provider_db(evicted_alias)
+                    removed += [evicted_alias]
+        if removed:
+            close_evicted_connections()
+            for evicted_alias in removed:
+                close_provider_db_pool(evicted_alias)
+    return connections.databases[alias]
+
+
+def hold_provider_dbs(aliases):
+    """
+    Prevents *aliases* from being removed from ``connections.databases``
+    until ``release_provider_dbs`` is called.
+    """
+    with _provider_dbs_lock:
+        for alias in aliases:
+            _provider_dbs_refs[alias] = _provider_dbs_refs.get(alias, 0) + 1
+
+
+def release_provider_dbs(aliases):
+    """
+    Releases *aliases* held by ``hold_provider_dbs``, and removes the ones
+    that were evicted while in use.
+    """
+    removed = []
+    with _provider_dbs_lock:
+        for alias in aliases:
+            count = _provider_dbs_refs.get(alias, 0) - 1
+            if count > 0:
+                _provider_dbs_refs[alias] = count
+                continue
+            _provider_dbs_refs.pop(alias, None)
+            if alias in _deferred_provider_dbs:
+                _deferred_provider_dbs.discard(alias)
+                _evict_provider_db(alias)
+                removed += [alias]
+    for alias in removed:
+        close_provider_db_pool(alias)
+
+
+def _release_provider_db_connection(alias):
+    with _provider_dbs_lock:
+        count = _provider_dbs_connections.get(alias, 0) - 1
+        if count > 0:
+            _provider_dbs_connections[alias] = count
+        else:
+            _provider_dbs_connections.pop(alias, None)
+            # No thread has a connection to close anymore.
+            _evicted_provider_dbs.discard(alias)
+
+
+def track_provider_db_connection(sender, connection, **kwargs):
+    #pylint:disable=unused-argument
+    """
+    Counts the threads with a connection to a site-specific database,
+    such that an evicted alias is forgotten once they all closed it.
+    """
+    alias = connection.alias
+    if (getattr(connection, 'multitier_release', None) is not None or
+        (alias not in _provider_dbs and
+         alias not in _deferred_provider_dbs)):
+        return
+    with _provider_dbs_lock:
+        _provider_dbs_connections[alias] = (
+            _provider_dbs_connections.get(alias, 0) + 1)
+    # Also called when the wrapper is garbage collected
+    # (ex: the thread exited).
+    connection.multitier_release = weakref.finalize(
+        connection, _release_provider_db_connection, alias)
+
+
+connection_created.connect(track_provider_db_connection,
+    dispatch_uid='multitier_track_provider_db_connection')
+
+
+def get_replica_dbs(site):
+    """
+    Returns the list of ``(alias, db_name, db_host, db_port)`` of the read
+    replicas declared in ``site.db_replicas`` alongside an iterator used
+    to choose between them.
+
+    For SQLite databases, each replica is the name of a database file
+    (ex: a copy of *db_name*) instead of a host. Replicas with a malformed
+    port are skipped.
+    """
+    db_name = site.db_name
+    db_replicas = site.db_replicas
+    if not db_name or not db_replicas:
+        return None, None
+    key = (db_name, db_replicas)
+    found = _replica_dbs.get(key)
+    if found is None:
+        is_sqlite = connections.databases[DEFAULT_DB_ALIAS][
+            'ENGINE'].endswith('sqlite3')
+        replicas = []
+        for replica in db_replicas.split(','):
+            replica = replica.strip()
+            if not replica:
+                continue
+            alias = '%s@%s' % (db_name, replica)
+            if is_sqlite:
+                replicas += [(alias, replica, None, None)]
+            else:
+                db_host, _, db_port = replica.partition(':')
+                if db_port:
+                    try:
+                        db_port = int(db_port)
+                    except ValueError:
+                        LOGGER.warning("multitier: site '%s' has a read"\
+                            " replica '%s' with an invalid port",
+                            site, replica)
+                        continue
+                replicas += [(alias, db_name, db_host,
+                    db_port or site.db_port)]
+        found = (tuple(replicas), itertools.count())
+        _replica_dbs.set(key, found)
+    return found
+
+
+def get_replica_db(primary):
+    """
+    Returns the alias of the read replica, chosen in round-robin, that reads
+    of models routed to the current site database *primary* should go to,
+    or ``None`` when they should go to *primary*.
+
+    Reads go to the primary database when the site has no replicas,
+    inside a transaction, and after ``pin_primary_db`` was called
+    while the site is current.
+    """
+    current_site = _current_site.get()
+    if current_site is None:
+        return None
+    site = current_site.snapshot
+    if (not site.db_replicas or site.db_name != primary or
+        _pinned_site.get() is current_site):
+        return None
+    replicas, counter = get_replica_dbs(site)
+    if not replicas:
+        return None
+    if (primary in connections.databases and
+        connections[primary].in_atomic_block):
+        return None
+    alias, db_name, db_host, db_port = replicas[
+        next(counter) % len(replicas)]
+    cache_provider_db(db_name, db_host=db_host, db_port=db_port, alias=alias)
+    return alias
+
+
+def pin_primary_db():
+    """
+    Sends all further reads for the current site to its primary database,
+    such that they see the effects of a write. This lasts until another
+    site (or the same site for another request) is made current.
+    """
+    current_site = _current_site.get()
+    if current_site is not None and _pinned_site.get() is not current_site:
+        _pinned_site.set(current_site)
+
+
+def close_evicted_connections():
+    """
+    Closes the connections opened by this thread to site-specific databases
+    that were since evicted from ``connections.databases``.
+
+    Once an alias is evicted, ``connections.close_all()`` does not see
+    its connections anymore. They must be closed here, in the thread
+    that opened them.
+    """
+    _provider_dbs_local.evictions = _provider_dbs_evictions
+    #pylint:disable=protected-access
+    for alias in list(_evicted_provider_dbs):
+        if (alias not in connections.databases and
+            hasattr(connections._connections, alias)):
+            connection = connections[alias]
+            try:
+                connection.close()
+            finally:
+                del connections[alias]
+                release = getattr(connection, 'multitier_release', None)
+                if release is not None:
+                    release()
+
+
+def check_evicted_connections(sender=None, **kwargs):
+    #pylint:disable=unused-argument
+    """
+    Calls ``close_evicted_connections`` when aliases were evicted since
+    this thread last closed its connections to evicted aliases.
+
+    This is cheap enough to be called on every routed query, such that
+    the thread that owns a connection (ex: the ``sync_to_async`` thread
+    under ASGI) is the one closing it.
+    """
+    if (getattr(_provider_dbs_local, 'evictions', 0)
+        != _provider_dbs_evictions):
+        close_evicted_connections()
+
+request_finished.connect(check_evicted_connections,
+    dispatch_uid='multitier_check_evicted_connections')
+
+
+def get_provider_db_stats():
+    """
+    Returns hits, misses and evictions of site-specific database aliases.
+    """
+    return _provider_dbs.stats()
+
+
+def get_provider_db_pool_stats():
+    """
+    Returns, for each site-specific database with a connection pool,
+    the statistics reported by the pool, including the time spent
+    waiting for a connection, and its utilization (connections checked
+    out over the maximum size of the pool).
+    """
+    results = {}
+    for alias, pool in list(_get_connection_pools().items()):
+        if alias not in _provider_dbs:
+            continue
+        stats = pool.get_stats()
+        in_use = stats.get('pool_size', 0) - stats.get('pool_available', 0)
+        stats.update({
+            'in_use': in_use,
+            'utilization': float(in_use) / pool.max_size
+        })
+        results[alias] = stats
+    return results
+
+
+def get_site_secret(site, field_name, load=None, version=None):
+    """
+    Returns the decrypted value of the encrypted field *field_name*
+    for *site*.
+
+    Values are cached for ``SITE_SECRETS_CACHE_TIMEOUT`` seconds,
+    and until the site is saved. *load* defaults to reading the field
+    on *site*. *version* (ex: the encrypted value) is part of the cache
+    key when it is available without decrypting.
+    """
+    if load is None:
+        load = lambda: getattr(site, field_name)
+    return _site_secrets.get_or_load((site.pk, field_name, version), load)
+
+
+def clear_site_secrets(sender=None, instance=None, **kwargs):
+    #pylint:disable=unused-argument
+    """
+    Forgets the decrypted values for *instance*, once the transaction
+    that saved it commits, or all of them.
+    """
+    if instance is None:
+        _site_secrets.clear()
+    else:
+        # Values decrypted before the commit would be the previous ones.
+        site_pk = instance.pk
+        transaction.on_commit(lambda: _site_secrets.discard_site(site_pk),
+            using=kwargs.get('using'))
+
+
+def get_site_secrets_stats():
+    """
+    Returns hits, misses and the number of decryptions of site secrets.
+    """
+    return _site_secrets.stats()
 
 
 def clear_cache():
-    try:
-        del _thread_locals.site
-    except AttributeError:
-        pass
+    _current_site.set(None)
 
 
 def get_current_site():
     """
-    Returns the ``Site`` associated to the thread request.
+    Returns the ``Site`` associated to the request being handled.
+    """
+    return _current_site.get()
+
+
+def get_site_settings():
+    """
+    Returns the read-only mapping of settings for the current site
+    (see ``SiteSnapshot.settings``).
     """
-    return getattr(_thread_locals, 'site', None)
+    site = _current_site.get()
+    if site is None:
+        return DEFAULT_SITE_SETTINGS
+    return site.site_settings
 
 
 def get_path_prefix():
@@ -154,17 +615,10 @@ def get_email_connection(site=None):
 
 
 def get_default_from_email():
-    site = get_current_site()
-    email_default_from = ""
-    email_host_user = ""
-    if site:
-        email_default_from = site.email_default_from
-        email_host_user = site.email_host_user
-    if email_default_from:
-        return email_default_from
-    if email_host_user and '@' in email_host_user:
-        return email_host_user
-    return ""
+    site = _current_site.get()
+    if site is not None:
+        return site.site_settings['default_from_email']
+    return DEFAULT_SITE_SETTINGS['default_from_email']
 
 # User and profile accounts settings
 # ----------------------------------
@@ -172,44 +626,41 @@ def get_authentication_override():
     """
     Returns the authentication settings for the current site.
     """
-    site = get_current_site()
-    if site:
-        return site.authentication
-    return 0
+    site = _current_site.get()
+    if site is not None:
+        return site.site_settings['authentication']
+    return DEFAULT_SITE_SETTINGS['authentication']
 
 
 def get_registration_type():
     """
     Returns the registration settings for the current site.
     """
-    site = get_current_site()
-    if site:
-        return site.registration
-    return 0
+    site = _current_site.get()
+    if site is not None:
+        return site.site_settings['registration']
+    return DEFAULT_SITE_SETTINGS['registration']
 
 
 def get_registration_requires_recaptcha():
-    site = get_current_site()
-    if site:
-        return site.registration_requires_recaptcha
-    return False
+    site = _current_site.get()
+    if site is not None:
+        return site.site_settings['registration_requires_recaptcha']
+    return DEFAULT_SITE_SETTINGS['registration_requires_recaptcha']
 
 
 def get_contact_requires_recaptcha():
-    site = get_current_site()
-    if site:
-        return site.contact_requires_recaptcha
-    return False
+    site = _current_site.get()
+    if site is not None:
+        return site.site_settings['contact_requires_recaptcha']
+    return DEFAULT_SITE_SETTINGS['contact_requires_recaptcha']
 
 
 def get_recaptcha_pub_key():
-    site = get_current_site()
-    value = ""
-    if site:
-        value = site.recaptcha_pub_key
-    if not value:
-        return ""
-    return value
+    site = _current_site.get()
+    if site is not None:
+        return site.site_settings['recaptcha_pub_key']
+    return DEFAULT_SITE_SETTINGS['recaptcha_pub_key']
 
 
 def get_recaptcha_priv_key():
@@ -217,7 +668,7 @@ def get_recaptcha_priv_key():
     value = ""
     if site:
         try:
-            value = site.recaptcha_priv_key
+            value = get_site_secret(site, 'recaptcha_priv_key')
         except: #pylint:disable=bare-except
             # might not be able to decrypt database field.
             LOGGER.error("cannot read recaptcha_priv_key for site '%s'", site)
@@ -227,13 +678,10 @@ def get_recaptcha_priv_key():
 
 
 def get_social_auth_azuread_oauth2_key():
-    site = get_current_site()
-    value = ""
-    if site:
-        value = site.social_auth_azuread_pub_key
-    if not value:
-        return ""
-    return value
+    site = _current_site.get()
+    if site is not None:
+        return site.site_settings['social_auth_azuread_pub_key']
+    return DEFAULT_SITE_SETTINGS['social_auth_azuread_pub_key']
 
 
 def get_social_auth_azuread_oauth2_secret():
@@ -241,7 +689,8 @@ def get_social_auth_azuread_oauth2_secret():
     value = ""
     if site:
         try:
-            value = site.social_auth_azuread_priv_key
+            value = get_site_secret(site,
+                'social_auth_azuread_priv_key')
         except: #pylint:disable=bare-except
             # might not be able to decrypt database field.
             LOGGER.error(
@@ -252,13 +701,10 @@ def get_social_auth_azuread_oauth2_secret():
 
 
 def get_social_auth_github_key():
-    site = get_current_site()
-    value = ""
-    if site:
-        value = site.social_auth_github_pub_key
-    if not value:
-        return ""
-    return value
+    site = _current_site.get()
+    if site is not None:
+        return site.site_settings['social_auth_github_pub_key']
+    return DEFAULT_SITE_SETTINGS['social_auth_github_pub_key']
 
 
 def get_social_auth_github_secret():
@@ -266,7 +712,8 @@ def get_social_auth_github_secret():
     value = ""
     if site:
         try:
-            value = site.social_auth_github_priv_key
+            value = get_site_secret(site,
+                'social_auth_github_priv_key')
         except: #pylint:disable=bare-except
             # might not be able to decrypt database field.
             LOGGER.error(
@@ -277,13 +724,10 @@ def get_social_auth_github_secret():
 
 
 def get_social_auth_google_oauth2_key():
-    site = get_current_site()
-    value = ""
-    if site:
-        value = site.social_auth_google_pub_key
-    if not value:
-        return ""
-    return value
+    site = _current_site.get()
+    if site is not None:
+        return site.site_settings['social_auth_google_pub_key']
+    return DEFAULT_SITE_SETTINGS['social_auth_google_pub_key']
 
 
 def get_social_auth_google_oauth2_secret():
@@ -291,7 +735,8 @@ def get_social_auth_google_oauth2_secret():
     value = ""
     if site:
         try:
-            value = site.social_auth_google_priv_key
+            value = get_site_secret(site,
+                'social_auth_google_priv_key')
         except: #pylint:disable=bare-except
             # might not be able to decrypt database field.
             LOGGER.error(
@@ -307,7 +752,7 @@ def get_google_api_key():
     value = ""
     if site:
         try:
-            value = site.google_api_key
+            value = get_site_secret(site, 'google_api_key')
         except: #pylint:disable=bare-except
             # might not be able to decrypt database field.
             LOGGER.error("cannot read google_api_key for site '%s'", site)
@@ -319,20 +764,17 @@ def get_google_api_key():
 # Payment processor
 # -----------------
 def get_processor_use_platform_keys():
-    site = get_current_site()
-    if site:
-        return site.processor_is_platform
-    return False
+    site = _current_site.get()
+    if site is not None:
+        return site.site_settings['processor_is_platform']
+    return DEFAULT_SITE_SETTINGS['processor_is_platform']
 
 
 def get_processor_pub_key():
-    site = get_current_site()
-    value = ""
-    if site:
-        value = site.processor_pub_key
-    if not value:
-        return ""
-    return value
+    site = _current_site.get()
+    if site is not None:
+        return site.site_settings['processor_pub_key']
+    return DEFAULT_SITE_SETTINGS['processor_pub_key']
 
 
 def get_processor_priv_key():
@@ -340,7 +782,7 @@ def get_processor_priv_key():
     value = ""
     if site:
         try:
-            value = site.processor_priv_key
+            value = get_site_secret(site, 'processor_priv_key')
         except: #pylint:disable=bare-except
             # might not be able to decrypt database field.
             LOGGER.error("cannot read processor_priv_key for site '%s'", site)
@@ -350,40 +792,31 @@ def get_processor_priv_key():
 
 
 def get_processor_client_id():
-    site = get_current_site()
-    value = ""
-    if site:
-        value = site.processor_client_key
-    if not value:
-        return ""
-    return value
+    site = _current_site.get()
+    if site is not None:
+        return site.site_settings['processor_client_key']
+    return DEFAULT_SITE_SETTINGS['processor_client_key']
 
 
 def get_processor_connect_callback_url():
-    site = get_current_site()
-    value = ""
-    if site:
-        value = site.connect_callback_url
-    if not value:
-        return ""
-    return value
+    site = _current_site.get()
+    if site is not None:
+        return site.site_settings['connect_callback_url']
+    return DEFAULT_SITE_SETTINGS['connect_callback_url']
 
 
 def get_enables_processor_test_keys():
-    site = get_current_site()
-    if site:
-        return site.enables_processor_test_keys
-    return False
+    site = _current_site.get()
+    if site is not None:
+        return site.site_settings['enables_processor_test_keys']
+    return DEFAULT_SITE_SETTINGS['enables_processor_test_keys']
 
 
 def get_processor_test_pub_key():
-    site = get_current_site()
-    value = ""
-    if site:
-        value = site.processor_test_pub_key
-    if not value:
-        return ""
-    return value
+    site = _current_site.get()
+    if site is not None:
+        return site.site_settings['processor_test_pub_key']
+    return DEFAULT_SITE_SETTINGS['processor_test_pub_key']
 
 
 def get_processor_test_priv_key():
@@ -391,7 +824,7 @@ def get_processor_test_priv_key():
     value = ""
     if site:
         try:
-            value = site.processor_test_priv_key
+            value = get_site_secret(site, 'processor_test_priv_key')
         except: #pylint:disable=bare-except
             # might not be able to decrypt database field.
             LOGGER.error(
@@ -402,74 +835,272 @@ def get_processor_test_priv_key():
 
 
 def get_processor_test_client_id():
-    site = get_current_site()
-    value = ""
-    if site:
-        value = site.processor_test_client_key
-    if not value:
-        return ""
-    return value
+    site = _current_site.get()
+    if site is not None:
+        return site.site_settings['processor_test_client_key']
+    return DEFAULT_SITE_SETTINGS['processor_test_client_key']
 
 
 def get_processor_test_connect_callback_url():
-    site = get_current_site()
-    value = ""
-    if site:
-        value = site.connect_test_callback_url
-    if not value:
-        return ""
-    return value
+    site = _current_site.get()
+    if site is not None:
+        return site.site_settings['connect_test_callback_url']
+    return DEFAULT_SITE_SETTINGS['connect_test_callback_url']
 
 
 # Notification workflow settings
 # ------------------------------
 def get_notification_webhook_url():
-    site = get_current_site()
-    value = ""
-    if site:
-        value = site.notification_webhook_url
-    if not value:
-        return ""
-    return value
+    site = _current_site.get()
+    if site is not None:
+        return site.site_settings['notification_webhook_url']
+    return DEFAULT_SITE_SETTINGS['notification_webhook_url']
 
 
 def get_notification_email_disabled():
-    site = get_current_site()
-    if site:
-        return site.notification_email_disabled
-    return False
+    site = _current_site.get()
+    if site is not None:
+        return site.site_settings['notification_email_disabled']
+    return DEFAULT_SITE_SETTINGS['notification_email_disabled']
 
 
-def set_current_site(site, path_prefix,
-        default_scheme='http', default_host='localhost', request=None):
+class LazyURLs(dict):
+    """
+    ``dict`` of ``settings.DEFAULT_URLS`` names to their URL for
+    a *current_site*, in the language active when it is created.
+
+    URLs already reversed for the same path prefix and language are copied
+    in. The others are reversed the first time they are read (see
+    ``__missing__``), or all at once when the whole mapping is used
+    (ex: iterated or serialized to JSON).
+    """
+    cache = LRUCache(maxsize=4096)
+
+    def __init__(self, current_site, url_names=None):
+        super(LazyURLs, self).__init__()
+        self._current_site = current_site
+        self._key = (get_script_prefix(), get_urlconf(),
+            current_site.path_prefix, get_language())
+        self._pending = {}
+        for url_name in (settings.DEFAULT_URLS
+                         if url_names is None else url_names):
+            url = self.cache.get(self._key + (url_name,))
+            if url is None:
+                self._pending[url_name] = True
+            else:
+                dict.__setitem__(self, url_name, url)
+        if self._pending and not dict.__len__(self):
+            # `json.dumps` writes an empty ``dict`` as "{}" without
+            # calling `items()`.
+            self._resolve(next(iter(self._pending)))
+
+    def _reverse(self, url_name):
+        key = self._key + (url_name,)
+        url = self.cache.get(key)
+        if url is None:
+            # ``reverse`` adds the path prefix of the current site.
+            token = _current_site.set(self._current_site)
+            try:
+                with override(self._key[3]):
+                    url = reverse(url_name)
+            finally:
+                _current_site.reset(token)
+            self.cache.set(key, url)
+        return url
+
+    def _resolve(self, url_name):
+        url = self._reverse(url_name)
+        del self._pending[url_name]
+        dict.__setitem__(self, url_name, url)
+        return url
+
+    def _resolve_all(self):
+        for url_name in list(self._pending):
+            self._resolve(url_name)
+
+    def __missing__(self, url_name):
+        if url_name not in self._pending:
+            raise KeyError(url_name)
+        return self._resolve(url_name)
+
+    def __setitem__(self, url_name, url):
+        self._pending.pop(url_name, None)
+        super(LazyURLs, self).__setitem__(url_name, url)
+
+    def __delitem__(self, url_name):
+        self._resolve_all()
+        super(LazyURLs, self).__delitem__(url_name)
+
+    def __contains__(self, url_name):
+        return (super(LazyURLs, self).__contains__(url_name) or
+            url_name in self._pending)
+
+    def __iter__(self):
+        self._resolve_all()
+        return super(LazyURLs, self).__iter__()
+
+    def __len__(self):
+        return super(LazyURLs, self).__len__() + len(self._pending)
+
+    def __eq__(self, other):
+        self._resolve_all()
+        return super(LazyURLs, self).__eq__(other)
+
+    def __ne__(self, other):
+        self._resolve_all()
+        return super(LazyURLs, self).__ne__(other)
+
+    __hash__ = None
+
+    def __or__(self, other):
+        self._resolve_all()
+        return dict(self) | other
+
+    def __repr__(self):
+        self._resolve_all()
+        return super(LazyURLs, self).__repr__()
+
+    def __reduce__(self):
+        return (dict, (self.copy(),))
+
+    def clear(self):
+        self._pending.clear()
+        super(LazyURLs, self).clear()
+
+    def copy(self):
+        self._resolve_all()
+        return dict(self)
+
+    def get(self, url_name, default=None):
+        try:
+            return self[url_name]
+        except KeyError:
+            return default
+
+    def items(self):
+        self._resolve_all()
+        return super(LazyURLs, self).items()
+
+    def keys(self):
+        self._resolve_all()
+        return super(LazyURLs, self).keys()
+
+    def pop(self, url_name, *args):
+        self._resolve_all()
+        return super(LazyURLs, self).pop(url_name, *args)
+
+    def popitem(self):
+        self._resolve_all()
+        return super(LazyURLs, self).popitem()
+
+    def setdefault(self, url_name, default=None):
+        self._resolve_all()
+        return super(LazyURLs, self).setdefault(url_name, default)
+
+    def update(self, *args, **kwargs):
+        for url_name, url in dict(*args, **kwargs).items():
+            self[url_name] = url
+
+    def values(self):
+        self._resolve_all()
+        return super(LazyURLs, self).values()
+
+
+def _activate_site(site, path_prefix, default_scheme=None, default_host=None):
+    """
+    Makes sure the database for *site* is configured and returns
+    the ``CurrentSite`` to set, alongside the previous one.
+    """
+    check_evicted_connections()
+    aliases = ()
     # Dynamically update the db used for auth and saas.
-    if site.db_name:
+    if site.db_name and settings.DB_SCHEMAS:
+        # All sites share ``schemas.SCHEMAS_DB_ALIAS``. Queries are
+        # directed to the site schema through the connection search_path.
+        LOGGER.debug(
+            "multitier: access site '%s' with prefix '%s', use schema '%s'",
+            site, path_prefix, site.db_name)
+    elif site.db_name:
         LOGGER.debug(
             "multitier: access site '%s' with prefix '%s', connect to db '%s'",
             site, path_prefix, site.db_name)
-        if not site.db_name in connections.databases:
+        if _provider_dbs.maxsize is not None:
+            # Held before the alias is added such that another thread
+            # cannot evict it in-between.
+            replicas, _ = get_replica_dbs(site)
+            aliases = (site.db_name,) + tuple(
+                [replica[0] for replica in (replicas or [])])
+            hold_provider_dbs(aliases)
+        try:
             cache_provider_db(site.db_name,
                 db_host=site.db_host, db_port=site.db_port)
+        except Exception:
+            release_provider_dbs(aliases)
+            raise
     else:
         LOGGER.debug(
             "multitier: access site '%s' with prefix '%s',"\
             " connect to db 'default'", site, path_prefix)
 
-    prev_site = None
-    prev_path_prefix = None
-    if (hasattr(_thread_locals, 'site')
-        and isinstance(_thread_locals.site, CurrentSite)):
-        prev_site = _thread_locals.site.db_object
-        prev_path_prefix = _thread_locals.site.path_prefix
-        _thread_locals.site.db_object = site
-        _thread_locals.site.path_prefix = path_prefix
-    else:
-        _thread_locals.site = CurrentSite(site, path_prefix,
-            default_scheme=default_scheme, default_host=default_host)
+    prev = _current_site.get()
+    if prev is not None:
+        if default_scheme is None:
+            default_scheme = prev.default_scheme
+        if default_host is None:
+            default_host = prev.default_host
+    # We never modify a ``CurrentSite`` in place because it might be shared
+    # with another context (ex: a task copied the context).
+    current_site = CurrentSite(site, path_prefix,
+        default_scheme=default_scheme or 'http',
+        default_host=default_host or 'localhost')
+    if aliases:
+        # Databases are in use as long as the ``CurrentSite`` can be
+        # reached, from a context, a copied context or a request.
+        weakref.finalize(current_site, release_provider_dbs, aliases)
+    return current_site, prev
+
+
+def set_current_site(site, path_prefix,
+        default_scheme=None, default_host=None, request=None):
+    """
+    Makes *site* the current site and returns the previous
+    ``(site, path_prefix)`` such that callers can restore it.
+
+    When *default_scheme* or *default_host* are not specified, they are
+    inherited from the previous current site if any.
+    """
+    current_site, prev = _activate_site(site, path_prefix,
+        default_scheme=default_scheme, default_host=default_host)
+    _current_site.set(current_site)
 
     if request is not None:
-        request.site = _thread_locals.site
-        request.urls = {}
-        for url_name in settings.DEFAULT_URLS:
-            request.urls.update({url_name: reverse(url_name)})
-    return (prev_site, prev_path_prefix)
+        request.site = current_site
+        request.urls = LazyURLs(current_site)
+    if prev is not None:
+        return (prev.db_object, prev.path_prefix)
+    return (None, None)
+
+
+@contextmanager
+def site_context(site, path_prefix='', default_scheme=None, default_host=None):
+    """
+    Makes *site* the current site for the duration of a ``with`` block,
+    or of each call to a decorated function, then restores the previous
+    current site, even when an exception is raised. Blocks can be nested.
+
+    Example::
+
+        for site in get_site_model().objects.filter(is_active=True):
+            with site_context(site):
+                send_reminders()
+
+    This is meant for background jobs and scripts. Unlike
+    ``set_current_site``, no request attributes are computed.
+    """
+    current_site, _ = _activate_site(site, path_prefix,
+        default_scheme=default_scheme, default_host=default_host)
+    token = _current_site.set(current_site)
+    try:
+        yield current_site
+    finally:
+        _current_site.reset(token)
@@ -26,6 +26,7 @@
 from django.urls.resolvers import URLPattern, URLResolver
 from django.utils.datastructures import MultiValueDict
 from django.utils.regex_helper import normalize
+from django.utils.translation import get_language
 
 
 from .thread_locals import get_current_site
@@ -48,6 +49,10 @@ class RegexURLResolver(URLResolver):
             path_prefix = current_site.path_prefix
         return path_prefix
 
+    def _get_cache_key(self):
+        # Reversed patterns depend on the language with `i18n_patterns`.
+        return (self._get_path_prefix(), get_language())
+
     # Implementation Note:
     # Copy/Pasted `RegexURLResolver._populate` here because that was the only
     # way to override `language_code = get_language()` to use a dynamic path
@@ -64,7 +69,7 @@ class RegexURLResolver(URLResolver):
             lookups = MultiValueDict()
             namespaces = {}
             apps = {}
-            path_prefix = self._get_path_prefix()
+            cache_key = self._get_cache_key()
             for url_pattern in reversed(self.url_patterns):
                 p_pattern = url_pattern.pattern.regex.pattern
                 if p_pattern.startswith('^'):
@@ -121,30 +126,30 @@ class RegexURLResolver(URLResolver):
                             apps.setdefault(app_name, []).extend(
                                 namespace_list)
                     self._callback_strs.update(url_pattern._callback_strs)
-            self._namespace_dict[path_prefix] = namespaces
-            self._app_dict[path_prefix] = apps
-            self._reverse_dict[path_prefix] = lookups
+            self._namespace_dict[cache_key] = namespaces
+            self._app_dict[cache_key] = apps
+            self._reverse_dict[cache_key] = lookups
             self._populated = True
         finally:
             self._local.populating = False
 
     @property
     def reverse_dict(self):
-        path_prefix = self._get_path_prefix()
-        if path_prefix not in self._reverse_dict:
+        cache_key = self._get_cache_key()
+        if cache_key not in self._reverse_dict:
             self._populate()
-        return self._reverse_dict[path_prefix]
+        return self._reverse_dict[cache_key]
 
     @property
     def namespace_dict(self):
-        path_prefix = self._get_path_prefix()
-        if path_prefix not in self._namespace_dict:
+        cache_key = self._get_cache_key()
+        if cache_key not in self._namespace_dict:
             self._populate()
-        return self._namespace_dict[path_prefix]
+        return self._namespace_dict[cache_key]
 
     @property
     def app_dict(self):
-        path_prefix = self._get_path_prefix()
-        if path_prefix not in self._app_dict:
+        cache_key = self._get_cache_key()
+        if cache_key not in self._app_dict:
             self._populate()
-        return self._app_dict[path_prefix]
+        return self._app_dict[cache_key]
@@ -28,6 +28,14 @@ from django.core.exceptions import ImproperlyConfigured
 from . import settings
 
 
+# Encrypted fields that are not needed to route a request and thus
+# are not loaded when a ``Site`` is resolved.
+SITE_DEFERRED_FIELDS = ('db_host_password', 'recaptcha_priv_key',
+    'social_auth_azuread_priv_key', 'social_auth_github_priv_key',
+    'social_auth_google_priv_key', 'google_api_key',
+    'processor_priv_key', 'processor_test_priv_key')
+
+
 def get_site_model():
     """
     Returns the ``Site`` model that is active in this Django project.
@@ -93,6 +93,7 @@ MIDDLEWARE_CLASSES = MIDDLEWARE
 
 ROOT_URLCONF = 'testsite.urls'
 WSGI_APPLICATION = 'testsite.wsgi.application'
+ASGI_APPLICATION = 'testsite.asgi.application'
 
 # Templates
 # ---------
@@ -140,10 +141,28 @@ DATABASE_ROUTERS = ('multitier.routers.SiteRouter',)
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite')
+        'NAME': os.path.join(BASE_DIR, 'db.sqlite'),
+        # Tests that read from multiple threads cannot use
+        # an in-memory database.
+        'TEST': {'NAME': os.path.join(RUN_DIR, 'test_db.sqlite')}
     }
 }
 
+if os.getenv('DB_ENGINE'):
+    # ex: DB_ENGINE=postgresql DB_HOST=localhost to run the tests
+    # against a PostgreSQL server.
+    DATABASES['default'] = {
+        'ENGINE': 'django.db.backends.%s' % os.getenv('DB_ENGINE'),
+        'NAME': os.getenv('DB_NAME', APP_NAME),
+        'USER': os.getenv('DB_USER', ''),
+        'PASSWORD': os.getenv('DB_PASSWORD', ''),
+        'HOST': os.getenv('DB_HOST', ''),
+        'PORT': os.getenv('DB_PORT', ''),
+        # multitier ships no migrations, so its tables, which reference
+        # `auth_user`, are created alongside the others.
+        'TEST': {'MIGRATE': False},
+    }
+
 DEFAULT_AUTO_FIELD = 'django.db.models.AutoField'
 
 if os.getenv('MULTITIER_DB_FILE'):
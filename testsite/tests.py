@@ -0,0 +1,1075 @@
+# Copyright (c) 2026, Djaodjin Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice,
+#    this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+# THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import asyncio, gc, json, os, shutil, smtplib, socketserver, sqlite3
+import socket, tempfile, threading, time
+from io import StringIO
+from unittest import mock, skipUnless
+
+from asgiref.sync import sync_to_async
+import django
+
+from django.conf.urls.i18n import i18n_patterns
+from django.contrib.auth.models import User
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.core import mail as django_mail
+from django.core.mail import EmailMessage
+from django.core.mail.backends.base import BaseEmailBackend
+from django.core.management import CommandError, call_command
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import (DEFAULT_DB_ALIAS, connection, connections, router,
+    transaction)
+from django.http import Http404, HttpResponse
+from django.test import (RequestFactory, TransactionTestCase,
+    override_settings)
+from django.urls import path
+from django.utils import translation
+
+from multitier import (mail, mailqueue, middleware, schemas,
+    settings as multitier_settings, thread_locals)
+from multitier.caches import SharedSiteCache, SiteCache
+from multitier.management.commands.probe_smtp import Command as ProbeSMTP
+from multitier.fanout import SiteTimeout, for_each_site
+from multitier.middleware import SiteMiddleware
+from multitier.models import Site, db_replicas_validator
+from multitier.thread_locals import (CurrentSite, LazyURLs, get_current_site,
+    site_context)
+
+
+urlpatterns = i18n_patterns(
+    path('profile/', HttpResponse, name='i18n_profile'),
+    path('billing/', HttpResponse, name='i18n_billing'),
+)
+
+
+class SMTPStandInHandler(socketserver.StreamRequestHandler):
+
+    def reply(self, line):
+        self.wfile.write(line.encode('ascii') + b'\r\n')
+
+    def handle(self):
+        with self.server.lock:
+            self.server.nb_connections += 1
+            self.server.sockets += [self.connection]
+        self.reply('220 localhost ESMTP')
+        lines = None
+        for line in self.rfile:
+            line = line.rstrip(b'\r\n')
+            if lines is not None:
+                if line == b'.':
+                    with self.server.lock:
+                        self.server.messages += [b'\n'.join(lines)]
+                    lines = None
+                    self.reply('250 queued')
+                else:
+                    lines += [line]
+                continue
+            verb = line[:4].upper()
+            if verb == b'MAIL' and self.server.refuse:
+                self.reply('554 refused')
+            elif verb == b'EHLO':
+                self.reply('250-localhost')
+                self.reply('250 AUTH PLAIN')
+            elif verb == b'AUTH':
+                self.reply('235 authenticated')
+            elif verb == b'DATA':
+                lines = []
+                self.reply('354 end with .')
+            elif verb == b'QUIT':
+                self.reply('221 bye')
+                break
+            else:
+                self.reply('250 ok')
+
+
+class SMTPStandIn(socketserver.ThreadingTCPServer):
+    """
+    Local SMTP server that accepts any message, for tests.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super(SMTPStandIn, self).__init__(
+            ('127.0.0.1', 0), SMTPStandInHandler)
+        self.lock = threading.Lock()
+        self.nb_connections = 0
+        self.sockets = []
+        self.messages = []
+        self.refuse = False
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def stop(self):
+        self.shutdown()
+        for sock in self.sockets:
+            sock.close()
+        self.server_close()
+
+
+class SiteCacheTests(TransactionTestCase):
+
+    def setUp(self):
+        self.site = Site.objects.create(slug='cached',
+            domain='cached.example.com', is_active=True)
+
+    @staticmethod
+    def lookup():
+        request = RequestFactory().get('/', HTTP_HOST='cached.example.com')
+        try:
+            site, _ = SiteMiddleware.as_candidate_site(request)
+        except Http404:
+            return None
+        return site
+
+    def lookup_in_thread(self):
+        found = []
+        def run():
+            try:
+                found.append(self.lookup())
+            finally:
+                connections.close_all()
+        thread = threading.Thread(target=run)
+        thread.start()
+        thread.join()
+        return found[0]
+
+    def test_save_in_atomic_with_concurrent_lookup(self):
+        self.assertEqual(self.lookup(), self.site)
+        with transaction.atomic():
+            self.site.is_active = False
+            self.site.save()
+            # A concurrent request still sees the committed row.
+            self.assertEqual(self.lookup_in_thread(), self.site)
+        self.assertIsNone(self.lookup())
+        self.assertIsNone(self.lookup_in_thread())
+
+    def test_rollback_keeps_cached_site(self):
+        self.assertEqual(self.lookup(), self.site)
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                self.site.is_active = False
+                self.site.save()
+                raise RuntimeError("rollback")
+        self.assertEqual(self.lookup_in_thread(), self.site)
+
+    def test_other_process_stops_serving_saved_site(self):
+        # The cache of another process, which `clear_site_cache` does not
+        # reach without a shared backend.
+        other_cache = SiteCache(timeout=0.5)
+        with mock.patch.object(middleware, '_site_cache', other_cache):
+            self.assertEqual(self.lookup(), self.site)
+        self.site.is_active = False
+        self.site.save()
+        with mock.patch.object(middleware, '_site_cache', other_cache):
+            self.assertEqual(self.lookup(), self.site)
+            time.sleep(0.6)
+            self.assertIsNone(self.lookup())
+
+
+class CurrentSiteTests(TransactionTestCase):
+
+    def setUp(self):
+        self.site = Site.objects.create(slug='current',
+            domain='current.example.com', is_active=True,
+            email_default_from='support@example.com')
+
+    def process_request(self):
+        request = RequestFactory().get('/', HTTP_HOST='current.example.com')
+        SiteMiddleware(lambda request: None).process_request(request)
+        return request
+
+    def tearDown(self):
+        thread_locals.clear_cache()
+
+    def test_db_object_per_request(self):
+        first = self.process_request()
+        second = self.process_request()
+        self.assertEqual(first.site.snapshot, second.site.snapshot)
+        self.assertIsNot(first.site.db_object, second.site.db_object)
+        first.site.db_object.email_default_from = 'changed@example.com'
+        third = self.process_request()
+        self.assertEqual(third.site.db_object.email_default_from,
+            'support@example.com')
+        self.assertEqual(third.site.snapshot.email_default_from,
+            'support@example.com')
+
+    def test_set_current_site_returns_model(self):
+        request = self.process_request()
+        prev_site, prev_path_prefix = thread_locals.set_current_site(
+            Site.objects.get(slug='current'), 'prefix')
+        self.assertIsInstance(prev_site, Site)
+        self.assertIs(prev_site, request.site.db_object)
+        self.assertEqual(prev_path_prefix, '')
+        self.assertEqual(Site.objects.filter(pk=prev_site.pk).get(),
+            self.site)
+
+
+@override_settings(ROOT_URLCONF=__name__)
+class LazyURLsTests(TransactionTestCase):
+
+    url_names = ('i18n_profile', 'i18n_billing')
+
+    def setUp(self):
+        LazyURLs.cache.clear()
+        self.current_site = CurrentSite(
+            Site.objects.create(slug='urls', domain='urls.example.com'), '')
+
+    def tearDown(self):
+        LazyURLs.cache.clear()
+
+    def as_urls(self, language):
+        with translation.override(language):
+            return LazyURLs(self.current_site, url_names=self.url_names)
+
+    def test_is_json_serializable_dict(self):
+        urls = self.as_urls('en')
+        self.assertIsInstance(urls, dict)
+        expected = {'i18n_profile': '/en/profile/',
+            'i18n_billing': '/en/billing/'}
+        self.assertEqual(json.loads(json.dumps(urls)), expected)
+        self.assertEqual(json.loads(json.dumps(self.as_urls('en'),
+            cls=DjangoJSONEncoder)), expected)
+        self.assertEqual(urls, expected)
+        self.assertEqual(len(urls), 2)
+
+    def test_reverse_on_first_read(self):
+        urls = self.as_urls('en')
+        self.assertIn('i18n_billing', urls)
+        self.assertNotIn('i18n_billing', dict.keys(urls))
+        self.assertEqual(urls['i18n_billing'], '/en/billing/')
+        self.assertEqual(urls.get('unknown'), None)
+        with self.assertRaises(KeyError):
+            urls['unknown'] #pylint:disable=pointless-statement
+        # Reversed URLs are copied in the mappings of later requests.
+        self.assertEqual(dict.keys(self.as_urls('en')), set(self.url_names))
+
+    def test_memoized_per_language(self):
+        self.assertEqual(self.as_urls('en')['i18n_profile'], '/en/profile/')
+        self.assertEqual(self.as_urls('fr')['i18n_profile'], '/fr/profile/')
+        self.assertEqual(json.loads(json.dumps(self.as_urls('fr'))),
+            {'i18n_profile': '/fr/profile/', 'i18n_billing': '/fr/billing/'})
+
+
+class SharedSiteCacheTestMixin(object):
+
+    cache_settings = {}
+
+    def setUp(self):
+        self.settings_override = override_settings(
+            CACHES={'shared': self.cache_settings})
+        self.settings_override.enable()
+        self.site = Site.objects.create(slug='shared',
+            domain='shared.example.com', is_active=True)
+        # `_shared_site_cache` of the process saving sites, and
+        # the one of another process polling the generation.
+        self.shared_cache = SharedSiteCache('shared', poll_interval=0)
+        self.other_cache = SharedSiteCache('shared', poll_interval=0)
+        self.other_cache.poll()
+
+    def tearDown(self):
+        self.shared_cache.cache.clear()
+        self.settings_override.disable()
+
+    def save_site(self, rollback=False):
+        with mock.patch.object(
+                middleware, '_shared_site_cache', self.shared_cache):
+            try:
+                with transaction.atomic():
+                    self.site.is_active = False
+                    self.site.save()
+                    # Not bumped until the transaction commits.
+                    self.assertFalse(self.other_cache.poll())
+                    if rollback:
+                        raise RuntimeError("rollback")
+            except RuntimeError:
+                pass
+
+    def test_bump_on_commit(self):
+        self.save_site()
+        self.assertTrue(self.other_cache.poll())
+        self.assertFalse(self.other_cache.poll())
+
+    def test_no_bump_on_rollback(self):
+        self.save_site(rollback=True)
+        self.assertFalse(self.other_cache.poll())
+
+    def test_poll_interval(self):
+        self.other_cache.poll_interval = 60
+        self.assertFalse(self.other_cache.poll_due())
+        self.shared_cache.bump()
+        # The change is only seen once *poll_interval* has elapsed.
+        self.assertFalse(self.other_cache.poll())
+        self.other_cache._polled_at -= 60 #pylint:disable=protected-access
+        self.assertTrue(self.other_cache.poll_due())
+        self.assertTrue(self.other_cache.poll())
+
+    def test_entries_unreachable_after_bump(self):
+        resolved = []
+        def resolve():
+            resolved.append(True)
+            return len(resolved)
+        key = ('shared.example.com', None)
+        self.assertEqual(self.other_cache.get_or_resolve(key, resolve), 1)
+        self.assertEqual(self.shared_cache.get_or_resolve(key, resolve), 1)
+        self.save_site()
+        self.assertTrue(self.other_cache.poll())
+        self.assertEqual(self.other_cache.get_or_resolve(key, resolve), 2)
+        self.assertEqual(self.shared_cache.get_or_resolve(key, resolve), 2)
+
+
+class LocMemSharedSiteCacheTests(SharedSiteCacheTestMixin,
+                                 TransactionTestCase):
+
+    cache_settings = {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'multitier-shared-site-cache',
+    }
+
+
+class FileBasedSharedSiteCacheTests(SharedSiteCacheTestMixin,
+                                    TransactionTestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.cache_settings = {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': self.cache_dir,
+        }
+        super(FileBasedSharedSiteCacheTests, self).setUp()
+
+    def tearDown(self):
+        super(FileBasedSharedSiteCacheTests, self).tearDown()
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+
+class ForEachSiteTests(TransactionTestCase):
+
+    def setUp(self):
+        self.sites = [Site.objects.create(slug='site%d' % idx)
+            for idx in range(4)]
+
+    def test_streams_results(self):
+        released = threading.Event()
+
+        def func(site):
+            if site.slug == 'site0':
+                released.wait(5)
+            return get_current_site().slug
+
+        results = for_each_site(func, sites=self.sites, max_workers=2)
+        slugs = []
+        for res in results:
+            if res.site.slug != 'site0':
+                slugs += [res.result]
+                if len(slugs) == 3:
+                    # site0 is still running.
+                    released.set()
+            else:
+                self.assertTrue(released.is_set())
+                slugs += [res.result]
+        self.assertEqual(slugs, ['site1', 'site2', 'site3', 'site0'])
+
+    def test_captures_errors(self):
+        def func(site):
+            if site.slug == 'site1':
+                raise ValueError(site.slug)
+            return site.slug
+
+        results = {res.site.slug: res
+            for res in for_each_site(func, sites=self.sites)}
+        self.assertIsInstance(results['site1'].error, ValueError)
+        self.assertIsNone(results['site1'].result)
+        for slug in ('site0', 'site2', 'site3'):
+            self.assertIsNone(results[slug].error)
+            self.assertEqual(results[slug].result, slug)
+
+    def test_hung_sites_do_not_block_others(self):
+        released = threading.Event()
+
+        def func(site):
+            if site.slug in ('site0', 'site1'):
+                released.wait(10)
+            return site.slug
+
+        start = time.monotonic()
+        try:
+            results = {res.site.slug: res for res in for_each_site(
+                func, sites=self.sites, max_workers=2, timeout=0.2)}
+        finally:
+            released.set()
+        self.assertLess(time.monotonic() - start, 2)
+        for slug in ('site0', 'site1'):
+            self.assertIsInstance(results[slug].error, SiteTimeout)
+        for slug in ('site2', 'site3'):
+            self.assertIsNone(results[slug].error)
+            self.assertEqual(results[slug].result, slug)
+
+
+class SMTPConnectionPoolTests(TransactionTestCase):
+
+    def setUp(self):
+        self.server = SMTPStandIn()
+        self.pool = mail.SMTPConnectionPool(maxsize=1, idle_timeout=60,
+            keepalive_interval=0, wait_timeout=5)
+        self.pool_patch = mock.patch.object(mail, '_smtp_pool', self.pool)
+        self.pool_patch.start()
+
+    def tearDown(self):
+        self.pool_patch.stop()
+        self.pool.clear()
+        self.server.stop()
+
+    def get_backend(self):
+        return mail.PooledEmailBackend(host='127.0.0.1',
+            port=self.server.port, username='user', password='secret',
+            use_tls=False, use_ssl=False, fail_silently=False)
+
+    def send(self, backend=None):
+        message = EmailMessage('subject', 'body', 'from@localhost',
+            ['to@localhost'])
+        return (backend or self.get_backend()).send_messages([message])
+
+    def test_reuse(self):
+        for _ in range(3):
+            self.assertEqual(self.send(), 1)
+        self.assertEqual(len(self.server.messages), 3)
+        self.assertEqual(self.server.nb_connections, 1)
+        stats = self.pool.stats()
+        self.assertEqual(stats['opened'], 1)
+        self.assertEqual(stats['reused'], 2)
+        self.assertEqual(stats['idle'], 1)
+        # Keys contain the password.
+        self.assertEqual(self.pool._in_use, {})
+
+    def test_cap_and_wait(self):
+        holder = self.get_backend()
+        holder.open()
+        errors = []
+
+        def send():
+            try:
+                self.send()
+            except Exception as err: #pylint:disable=broad-except
+                errors.append(err)
+
+        thread = threading.Thread(target=send)
+        thread.start()
+        time.sleep(0.2)
+        # At most one connection per key: the other sender waits.
+        self.assertEqual(self.server.nb_connections, 1)
+        self.assertEqual(self.pool.stats()['in_use'], 1)
+        holder.close()
+        thread.join(5)
+        self.assertEqual(errors, [])
+        self.assertEqual(len(self.server.messages), 1)
+        self.assertEqual(self.server.nb_connections, 1)
+        self.assertGreaterEqual(self.pool.stats()['waits'], 1)
+
+        holder.open()
+        self.pool.wait_timeout = 0.1
+        with self.assertRaises(smtplib.SMTPException):
+            self.send()
+        holder.close()
+
+    def test_idle_close(self):
+        self.pool.idle_timeout = 0.1
+        self.send()
+        time.sleep(0.2)
+        self.pool.keepalive()
+        stats = self.pool.stats()
+        self.assertEqual(stats['idle'], 0)
+        self.assertEqual(stats['closed'], 1)
+        self.assertEqual(self.pool._idle, {})
+        self.send()
+        self.assertEqual(self.server.nb_connections, 2)
+
+    def test_discard_broken(self):
+        self.send()
+        self.server.refuse = True
+        with self.assertRaises(smtplib.SMTPException):
+            self.send()
+        stats = self.pool.stats()
+        self.assertEqual(stats['idle'], 0)
+        self.assertEqual(stats['in_use'], 0)
+        self.assertEqual(stats['closed'], 1)
+        self.assertEqual(self.pool._in_use, {})
+        self.assertEqual(self.pool._idle, {})
+        self.server.refuse = False
+        self.send()
+        self.assertEqual(self.server.nb_connections, 2)
+
+
+class ProbeSMTPTests(TransactionTestCase):
+
+    def setUp(self):
+        self.server = SMTPStandIn()
+        # Nothing listens on that port once the socket is closed.
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            closed_port = sock.getsockname()[1]
+        self.sites = []
+        for slug, port in (('site0', self.server.port),
+                ('site1', self.server.port), ('site2', closed_port)):
+            site = Site(slug=slug, is_active=True, email_host='127.0.0.1',
+                email_port=port, email_host_user='user')
+            site.set_email_host_password('secret')
+            site.save()
+            self.sites += [site]
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_probe(self):
+        out = StringIO()
+        call_command('probe_smtp', '--sites', 'site0,site1', '--send',
+            'to@localhost', stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertTrue(lines[1].startswith('site0'))
+        self.assertTrue(lines[1].endswith('ok'))
+        self.assertTrue(lines[2].endswith('ok'))
+        self.assertIn("2 sites (1 SMTP servers)", lines[-1])
+        # Sites sharing a server and credentials are probed once.
+        self.assertEqual(self.server.nb_connections, 1)
+        self.assertEqual(len(self.server.messages), 1)
+
+    def test_probe_failure(self):
+        out = StringIO()
+        with self.assertRaises(CommandError):
+            call_command('probe_smtp', stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertIn("connect failed", lines[3])
+        self.assertIn("3 sites (2 SMTP servers)", lines[-1])
+        with self.assertRaises(CommandError):
+            call_command('probe_smtp', '--sites', 'site0,unknown')
+
+    def test_ssl_kwargs_without_ssl_context(self):
+        class LegacyEmailBackend(object):
+            # ``EmailBackend`` in Django 3.2
+            ssl_keyfile = 'key.pem'
+            ssl_certfile = 'cert.pem'
+
+        self.assertEqual(ProbeSMTP.get_ssl_kwargs(LegacyEmailBackend()),
+            {'keyfile': 'key.pem', 'certfile': 'cert.pem'})
+        backend = self.sites[0].get_email_connection(
+            backend='django.core.mail.backends.smtp.EmailBackend')
+        self.assertEqual(list(ProbeSMTP.get_ssl_kwargs(backend)),
+            ['context'])
+
+
+class FailingEmailBackend(BaseEmailBackend):
+
+    def send_messages(self, email_messages):
+        raise smtplib.SMTPServerDisconnected("connection lost")
+
+
+class EmailQueueTests(TransactionTestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.spool_path = os.path.join(self.tmpdir, 'spool.sqlite')
+        self.spool = mailqueue.EmailSpool(self.spool_path, lease=0.2)
+        self.site = Site.objects.create(slug='site0')
+        django_mail.outbox = []
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def get_worker(self, **kwargs):
+        kwargs.setdefault('backend',
+            'django.core.mail.backends.locmem.EmailBackend')
+        # Workers in different processes have their own ``EmailSpool``.
+        return mailqueue.EmailQueueWorker(
+            mailqueue.EmailSpool(self.spool_path), **kwargs)
+
+    def enqueue(self, count, site_id=None):
+        return self.spool.enqueue(site_id or self.site.pk,
+            [EmailMessage('subject %d' % idx, 'body', 'from@localhost',
+                ['to@localhost']) for idx in range(count)])
+
+    def get_rows(self):
+        with sqlite3.connect(self.spool_path) as conn:
+            return conn.execute("SELECT status, attempts, next_attempt_at,"\
+                " last_error FROM messages ORDER BY id").fetchall()
+
+    def make_due(self):
+        with sqlite3.connect(self.spool_path) as conn:
+            conn.execute("UPDATE messages SET next_attempt_at = 0")
+
+    def test_spool_then_send(self):
+        with mock.patch.object(multitier_settings,
+                'EMAIL_QUEUE_WORKER', False):
+            with mock.patch.object(mailqueue, '_email_spool', self.spool):
+                backend = mailqueue.QueuedEmailBackend(site=self.site)
+                self.assertEqual(backend.send_messages([
+                    EmailMessage('subject', 'body', 'from@localhost',
+                        ['to@localhost'])] * 2), 2)
+        self.assertEqual(self.spool.stats(), {'queued': 2, 'failed': 0})
+        self.assertEqual(django_mail.outbox, [])
+        worker = self.get_worker()
+        worker.drain()
+        self.assertEqual(len(django_mail.outbox), 2)
+        self.assertEqual(worker.stats()['sent'], 2)
+        self.assertEqual(self.spool.stats(), {'queued': 0, 'failed': 0})
+
+    def test_lease(self):
+        self.enqueue(1)
+        rows, _ = self.spool.claim(10)
+        self.assertEqual(len(rows), 1)
+        # Claimed by another worker.
+        rows, _ = self.spool.claim(10)
+        self.assertEqual(rows, [])
+        time.sleep(0.3)
+        # The lease expired without the message being sent.
+        rows, _ = self.spool.claim(10)
+        self.assertEqual(len(rows), 1)
+
+    def test_retry_with_backoff(self):
+        self.enqueue(1)
+        worker = self.get_worker(backend='testsite.tests.FailingEmailBackend',
+            retry_delay=10, max_attempts=3)
+        for attempts in (1, 2):
+            start = time.time()
+            worker.drain()
+            status, nb_attempts, next_attempt_at, last_error = (
+                self.get_rows()[0])
+            self.assertEqual(status, mailqueue.STATUS_QUEUED)
+            self.assertEqual(nb_attempts, attempts)
+            self.assertIn("connection lost", last_error)
+            delay = 10 * 2 ** (attempts - 1)
+            self.assertGreaterEqual(next_attempt_at, start + delay)
+            self.assertLess(next_attempt_at, time.time() + delay)
+            # Not due yet.
+            worker.drain()
+            self.assertEqual(self.get_rows()[0][1], attempts)
+            self.make_due()
+        worker.drain()
+        self.assertEqual(self.get_rows()[0][0], mailqueue.STATUS_FAILED)
+        self.assertEqual(worker.stats()['retried'], 2)
+        self.assertEqual(worker.stats()['gave_up'], 1)
+        self.assertEqual(django_mail.outbox, [])
+
+    def test_rate_limit_shared_by_workers(self):
+        self.enqueue(5)
+        workers = [self.get_worker(rate_limit=3) for _ in range(2)]
+        for worker in workers:
+            worker.drain()
+        self.assertEqual(len(django_mail.outbox), 3)
+        self.assertEqual(self.spool.stats()['queued'], 2)
+        # A minute later.
+        with sqlite3.connect(self.spool_path) as conn:
+            conn.execute(
+                "UPDATE rate_buckets SET updated_at = updated_at - 60")
+        workers[1].drain()
+        self.assertEqual(len(django_mail.outbox), 5)
+        self.assertEqual(self.spool.stats()['queued'], 0)
+
+
+class ProviderDbTestMixin(object):
+    """
+    Creates the site-specific databases *db_names* before each test
+    and removes them afterwards.
+    """
+    db_names = ()
+
+    @classmethod
+    def setUpClass(cls):
+        super(ProviderDbTestMixin, cls).setUpClass()
+        # Site-specific databases are only known once a site is activated.
+        cls.databases = frozenset(cls.databases) | frozenset(cls.db_names)
+
+    def create_provider_dbs(self):
+        # sqlite3 databases are created on first connect.
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                for db_name in self.db_names:
+                    cursor.execute('DROP DATABASE IF EXISTS "%s"' % db_name)
+                    cursor.execute('CREATE DATABASE "%s"' % db_name)
+
+    def drop_provider_dbs(self):
+        thread_locals._provider_dbs.clear()
+        thread_locals._evicted_provider_dbs.clear()
+        for db_name in self.db_names:
+            if db_name in connections.databases:
+                connections[db_name].close()
+                del connections[db_name]
+                connections.databases.pop(db_name)
+            thread_locals.close_provider_db_pool(db_name)
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                for db_name in self.db_names:
+                    cursor.execute(
+                        'DROP DATABASE IF EXISTS "%s" WITH (FORCE)' % db_name)
+        elif connection.vendor == 'sqlite':
+            for db_name in self.db_names:
+                db_path = os.path.join(os.path.dirname(
+                    connections.databases[DEFAULT_DB_ALIAS]['NAME']),
+                    db_name + '.sqlite')
+                if os.path.exists(db_path):
+                    os.remove(db_path)
+
+
+class ProviderDbEvictionTests(ProviderDbTestMixin, TransactionTestCase):
+
+    db_names = ('tenant1', 'tenant2')
+
+    def setUp(self):
+        self.create_provider_dbs()
+        self.maxsize = thread_locals._provider_dbs.maxsize
+        thread_locals._provider_dbs.maxsize = 1
+        self.sites = [Site.objects.create(slug=db_name, db_name=db_name)
+            for db_name in self.db_names]
+
+    def tearDown(self):
+        thread_locals._provider_dbs.maxsize = self.maxsize
+        self.drop_provider_dbs()
+
+    def test_no_eviction_while_in_use(self):
+        activated = threading.Event()
+        evicted = threading.Event()
+        errors = []
+
+        def use_tenant1():
+            try:
+                with site_context(self.sites[0]):
+                    activated.set()
+                    evicted.wait(5)
+                    with connections['tenant1'].cursor() as cursor:
+                        cursor.execute("SELECT 1")
+            except Exception as err: #pylint:disable=broad-except
+                errors.append(err)
+            finally:
+                connections.close_all()
+
+        def use_tenant2():
+            activated.wait(5)
+            try:
+                with site_context(self.sites[1]):
+                    with connections['tenant2'].cursor() as cursor:
+                        cursor.execute("SELECT 1")
+            finally:
+                evicted.set()
+                connections.close_all()
+
+        threads = [threading.Thread(target=use_tenant1),
+            threading.Thread(target=use_tenant2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        # Once released, the least recently used alias is removed.
+        gc.collect()
+        self.assertNotIn('tenant1', connections.databases)
+        self.assertIn('tenant2', connections.databases)
+        # Threads that had a connection to it have exited.
+        self.assertNotIn('tenant1', thread_locals._evicted_provider_dbs)
+
+    def test_close_in_sync_to_async_thread(self):
+        # Under ASGI, the site is activated in the event loop thread
+        # while queries run in a ``sync_to_async`` thread.
+        def query():
+            with connections[router.db_for_read(User)].cursor() as cursor:
+                cursor.execute("SELECT 1")
+
+        async def serve(site):
+            with site_context(site):
+                await sync_to_async(query)()
+
+        async def serve_all():
+            for site in self.sites:
+                await serve(site)
+                gc.collect()
+            # No site is activated in the ``sync_to_async`` thread.
+            self.assertNotIn('tenant1', connections.databases)
+            self.assertNotIn('tenant1', thread_locals._evicted_provider_dbs)
+            self.assertNotIn('tenant1',
+                thread_locals._provider_dbs_connections)
+            await sync_to_async(connections.close_all)()
+
+        asyncio.run(serve_all())
+
+
+class ReplicaDbTests(ProviderDbTestMixin, TransactionTestCase):
+
+    db_names = ('tenant1', 'tenant1_copy')
+    replica_alias = 'tenant1@tenant1_copy'
+
+    @classmethod
+    def setUpClass(cls):
+        super(ReplicaDbTests, cls).setUpClass()
+        cls.databases = cls.databases | frozenset([cls.replica_alias])
+
+    def tearDown(self):
+        if self.replica_alias in connections.databases:
+            connections[self.replica_alias].close()
+            del connections[self.replica_alias]
+            connections.databases.pop(self.replica_alias)
+        thread_locals._replica_dbs.clear()
+        self.drop_provider_dbs()
+
+    @staticmethod
+    def get_origin(using):
+        with connections[using].cursor() as cursor:
+            cursor.execute("SELECT name FROM origin")
+            return cursor.fetchone()[0]
+
+    @skipUnless(connection.vendor == 'sqlite',
+        "a replica is a copy of the SQLite database file")
+    def test_reads_go_to_replica(self):
+        site = Site.objects.create(slug='tenant1', db_name='tenant1',
+            db_replicas='tenant1_copy')
+        with site_context(site):
+            with connections['tenant1'].cursor() as cursor:
+                cursor.execute("CREATE TABLE origin (name text)")
+                cursor.execute("INSERT INTO origin VALUES ('primary')")
+            primary_path = connections['tenant1'].settings_dict['NAME']
+            connections['tenant1'].close()
+        replica_path = os.path.join(os.path.dirname(primary_path),
+            'tenant1_copy.sqlite')
+        shutil.copy(primary_path, replica_path)
+        with sqlite3.connect(replica_path) as replica:
+            replica.execute("UPDATE origin SET name = 'replica'")
+
+        with site_context(site):
+            self.assertEqual(router.db_for_read(User), self.replica_alias)
+            self.assertEqual(self.get_origin(router.db_for_read(User)),
+                'replica')
+            with transaction.atomic(using='tenant1'):
+                self.assertEqual(self.get_origin(router.db_for_read(User)),
+                    'primary')
+            router.db_for_write(User)
+            self.assertEqual(self.get_origin(router.db_for_read(User)),
+                'primary')
+        with site_context(site):
+            self.assertEqual(self.get_origin(router.db_for_read(User)),
+                'replica')
+
+    def test_invalid_replica_port(self):
+        site = Site(slug='tenant1', db_name='tenant1',
+            db_replicas='replica1:port, replica2:5433')
+        with self.assertRaises(ValidationError):
+            db_replicas_validator(site.db_replicas)
+        db_replicas_validator('replica1, replica2:5433')
+        with mock.patch.dict(connections.databases[DEFAULT_DB_ALIAS],
+                {'ENGINE': 'django.db.backends.postgresql'}):
+            replicas, _ = thread_locals.get_replica_dbs(site)
+        self.assertEqual(replicas,
+            (('tenant1@replica2:5433', 'tenant1', 'replica2', 5433),))
+
+
+class ProviderDbPoolSettingsTests(TransactionTestCase):
+
+    def test_check_db_pool_settings(self):
+        with mock.patch.object(multitier_settings, 'DB_POOL', True):
+            with mock.patch.object(
+                    multitier_settings, 'DB_ALIASES_MAX', None):
+                with self.assertRaises(ImproperlyConfigured):
+                    thread_locals.check_db_pool_settings()
+        with mock.patch.object(multitier_settings, 'DB_POOL', None):
+            thread_locals.check_db_pool_settings()
+
+    def test_provider_db_without_persistent_connections(self):
+        default_db = connections.databases[DEFAULT_DB_ALIAS]
+        with mock.patch.dict(default_db, {'CONN_MAX_AGE': 60}):
+            with mock.patch.object(multitier_settings, 'DB_POOL',
+                    {'max_size': 2}):
+                provider_db = thread_locals.as_provider_db('tenant1')
+            self.assertEqual(provider_db['CONN_MAX_AGE'], 0)
+            self.assertEqual(provider_db['OPTIONS']['pool'], {'max_size': 2})
+            provider_db = thread_locals.as_provider_db('tenant1')
+            self.assertEqual(provider_db['CONN_MAX_AGE'], 60)
+            self.assertNotIn('pool', provider_db.get('OPTIONS', {}))
+
+
+@skipUnless(connection.vendor == 'postgresql' and django.VERSION >= (5, 1),
+    "connection pools require PostgreSQL and Django 5.1+")
+class ProviderDbPoolTests(ProviderDbTestMixin, TransactionTestCase):
+
+    db_names = ('multitier_pool1', 'multitier_pool2')
+
+    def setUp(self):
+        self.create_provider_dbs()
+        self.sites = [Site.objects.create(slug=db_name.replace('_', '-'),
+            db_name=db_name) for db_name in self.db_names]
+        self.maxsize = thread_locals._provider_dbs.maxsize
+        thread_locals._provider_dbs.maxsize = 1
+        self.settings_patches = [
+            mock.patch.object(multitier_settings, 'DB_POOL',
+                {'min_size': 1, 'max_size': 2, 'timeout': 10}),
+            mock.patch.object(multitier_settings, 'DB_ALIASES_MAX', 1)]
+        for patch in self.settings_patches:
+            patch.start()
+
+    def tearDown(self):
+        for patch in self.settings_patches:
+            patch.stop()
+        thread_locals._provider_dbs.maxsize = self.maxsize
+        self.drop_provider_dbs()
+
+    def query_in_threads(self, site, nb_threads):
+        def run():
+            try:
+                with site_context(site):
+                    with connections[site.db_name].cursor() as cursor:
+                        cursor.execute("SELECT pg_sleep(0.2)")
+            finally:
+                # Returns the connection to the pool.
+                connections.close_all()
+        threads = [threading.Thread(target=run) for _ in range(nb_threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def test_threads_share_bounded_pool(self):
+        self.query_in_threads(self.sites[0], 4)
+        stats = thread_locals.get_provider_db_pool_stats()['multitier_pool1']
+        self.assertEqual(stats['requests_num'], 4)
+        self.assertLessEqual(stats['connections_num'], 2)
+        self.assertGreater(stats.get('requests_waiting', 0) +
+            stats.get('requests_wait_ms', 0), 0)
+        self.assertEqual(
+            connections.databases['multitier_pool1']['CONN_MAX_AGE'], 0)
+
+    def test_evicted_pool_is_closed(self):
+        self.query_in_threads(self.sites[0], 1)
+        gc.collect()
+        self.query_in_threads(self.sites[1], 1)
+        gc.collect()
+        pools = thread_locals._get_connection_pools()
+        self.assertNotIn('multitier_pool1', pools)
+        self.assertIn('multitier_pool2', pools)
+
+
+class SchemaSettingsTests(TransactionTestCase):
+
+    def test_check_db_schemas_settings(self):
+        default_db = connections.databases[DEFAULT_DB_ALIAS]
+        with mock.patch.object(multitier_settings, 'DB_SCHEMAS', True):
+            with mock.patch.dict(default_db,
+                    {'ENGINE': 'django.db.backends.sqlite3'}):
+                with self.assertRaises(ImproperlyConfigured):
+                    thread_locals.check_db_schemas_settings()
+        with mock.patch.object(multitier_settings, 'DB_SCHEMAS', False):
+            thread_locals.check_db_schemas_settings()
+
+
+@skipUnless(connection.vendor == 'postgresql',
+    "schema-per-site requires PostgreSQL")
+class SchemaPerSiteTests(TransactionTestCase):
+
+    db_names = ('multitier_schema1', 'multitier_schema2')
+
+    @classmethod
+    def setUpClass(cls):
+        super(SchemaPerSiteTests, cls).setUpClass()
+        # The alias is only known once a schema site is activated.
+        cls.databases = frozenset(cls.databases) | frozenset(
+            [schemas.SCHEMAS_DB_ALIAS])
+
+    def setUp(self):
+        self.settings_patch = mock.patch.object(
+            multitier_settings, 'DB_SCHEMAS', True)
+        self.settings_patch.start()
+        self.sites = [Site.objects.create(slug=db_name.replace('_', '-'),
+            db_name=db_name) for db_name in self.db_names]
+        call_command('run_for_sites', '--sites', ','.join(
+            [site.slug for site in self.sites]), 'migrate', '--noinput',
+            stdout=StringIO())
+
+    def tearDown(self):
+        self.settings_patch.stop()
+        alias = schemas.SCHEMAS_DB_ALIAS
+        if alias in connections.databases:
+            connections[alias].close()
+            del connections[alias]
+            connections.databases.pop(alias)
+        with connection.cursor() as cursor:
+            for db_name in self.db_names:
+                cursor.execute('DROP SCHEMA IF EXISTS "%s" CASCADE' % db_name)
+
+    @staticmethod
+    def get_usernames():
+        return list(User.objects.order_by('username').values_list(
+            'username', flat=True))
+
+    def test_migrate_creates_tables_in_schema(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT table_schema, table_name"\
+                " FROM information_schema.tables"\
+                " WHERE table_name IN ('auth_user', 'django_migrations')"\
+                " AND table_schema = ANY(%s)", [list(self.db_names)])
+            tables = set(cursor.fetchall())
+        self.assertEqual(tables, set([(db_name, table_name)
+            for db_name in self.db_names
+            for table_name in ('auth_user', 'django_migrations')]))
+
+    def test_sites_share_connection(self):
+        with site_context(self.sites[0]):
+            self.assertEqual(router.db_for_write(User),
+                schemas.SCHEMAS_DB_ALIAS)
+            User.objects.create(username='alice')
+            db_connection = connections[
+                schemas.SCHEMAS_DB_ALIAS].connection
+        with site_context(self.sites[1]):
+            self.assertEqual(router.db_for_read(User),
+                schemas.SCHEMAS_DB_ALIAS)
+            self.assertEqual(self.get_usernames(), [])
+            User.objects.create(username='bob')
+            self.assertIs(connections[schemas.SCHEMAS_DB_ALIAS].connection,
+                db_connection)
+        with site_context(self.sites[0]):
+            self.assertEqual(self.get_usernames(), ['alice'])
+        self.assertFalse(User.objects.filter(
+            username__in=['alice', 'bob']).exists())
+
+    def test_search_path_after_rollback(self):
+        with site_context(self.sites[0]):
+            User.objects.create(username='alice')
+        with site_context(self.sites[1]):
+            User.objects.create(username='bob')
+        with transaction.atomic(using=schemas.SCHEMAS_DB_ALIAS):
+            with site_context(self.sites[0]):
+                self.assertEqual(self.get_usernames(), ['alice'])
+                sid = transaction.savepoint(using=schemas.SCHEMAS_DB_ALIAS)
+            with site_context(self.sites[1]):
+                self.assertEqual(self.get_usernames(), ['bob'])
+                transaction.savepoint_rollback(sid,
+                    using=schemas.SCHEMAS_DB_ALIAS)
+                # The savepoint rollback undid the ``SET search_path``.
+                self.assertEqual(self.get_usernames(), ['bob'])
+        try:
+            with transaction.atomic(using=schemas.SCHEMAS_DB_ALIAS):
+                with site_context(self.sites[0]):
+                    self.assertEqual(self.get_usernames(), ['alice'])
+                    raise ValueError()
+        except ValueError:
+            pass
+        # So did the transaction rollback.
+        with site_context(self.sites[0]):
+            self.assertEqual(self.get_usernames(), ['alice'])